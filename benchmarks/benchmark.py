@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+'''
+Headless benchmarks for the parts of IA Launcher that determine how
+fast it starts and how smooth browsing feels: loading the catalog,
+navigating the games list, decoding and scaling title screens, and
+drawing text.
+
+Every benchmark runs on synthetic games directories of different
+sizes, so that the results don't depend on the included games and
+show how each operation scales. No window is opened and DOSBox is
+never started. Example usage:
+
+    python benchmarks/benchmark.py --sizes 3000 30000 --output results.json
+
+The results are written as JSON, so that they can be compared from
+release to release.
+
+'''
+import os, sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame as pg
+
+from ialauncher import options
+from ialauncher.catalog import VERSION, FILENAME
+from ialauncher.gamelist import GameList
+from ialauncher.scenes import Loading
+from ialauncher.search import SearchIndex
+from ialauncher.engine import Scene
+
+SIZES = [3000, 30000, 300000]
+RESOLUTIONS = [(640, 480), (1280, 720), (1920, 1080), (3840, 2160)]
+TITLES = 50
+CATALOG_MTIME = 1000000000 * 10 ** 9
+WORDS = '''
+    alien ancient battle castle cyber dark death dragon dungeon empire
+    fighter galaxy hero island jungle knight legend magic mega night
+    pinball planet quest racer rescue robot space star super tank
+    thunder tower treasure ultimate war wizard world zone
+'''.split()
+
+
+def measure(function, repeat, setup=None):
+    '''Call function repeat times and return statistics of the durations'''
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'max': max(times),
+        'runs': repeat,
+    }
+
+
+def title_screen(path, rng):
+    '''Save a random 8-bit title screen, like the ones in the games directory'''
+    image = pg.Surface((320, 200), depth=8)
+    image.set_palette([[rng.randrange(256) for _ in range(3)] for _ in range(256)])
+    for _ in range(40):
+        rect = rng.randrange(320), rng.randrange(200), rng.randrange(1, 160), rng.randrange(1, 100)
+        image.fill(rng.randrange(256), rect)
+    pg.image.save(image, path)
+
+
+def create_games_dir(path, size, metadata_files, rng):
+    '''
+    Create a games directory with size games. The catalog is written
+    directly, so that metadata.ini files (which take a lot of space
+    for large sizes) are only needed to benchmark a full scan.
+
+    '''
+    entries = {}
+    for i in range(size):
+        words = rng.sample(WORDS, 2)
+        identifier = f'{words[0]}{words[1].capitalize()}{i}'
+        title = f'{words[0].title()} {words[1].title()} {i}'
+        year = str(rng.randrange(1981, 2000))
+        url = f'https://archive.org/download/msdos_{identifier}/{identifier}.zip'
+        mtime = None
+        if metadata_files:
+            os.makedirs(os.path.join(path, identifier))
+            inifile = os.path.join(path, identifier, 'metadata.ini')
+            with open(inifile, 'w') as f:
+                f.write(f'[metadata]\ntitle = {title}\nyear = {year}\nurl = {url}\nemulator_start = {identifier[:8].upper()}.EXE\n')
+            mtime = os.stat(inifile).st_mtime_ns
+        entries[identifier] = [mtime, title, year, [url], f'{identifier[:8].upper()}.EXE', None]
+
+    titled = rng.sample(sorted(entries), min(TITLES, size))
+    for identifier in titled:
+        os.makedirs(os.path.join(path, identifier), exist_ok=True)
+        title_screen(os.path.join(path, identifier, 'title.png'), rng)
+
+    with open(os.path.join(path, FILENAME), 'w') as f:
+        json.dump({'version': VERSION, 'mtime': CATALOG_MTIME, 'games': entries}, f)
+    os.utime(path, ns=(CATALOG_MTIME, CATALOG_MTIME))
+    return titled
+
+
+def load(screen, games_dir, rescan=False):
+    '''Run the Loading scene until it hands over to the Browse scene'''
+    return Loading(rescan=rescan, games_dir=games_dir).run(screen)
+
+
+def benchmark_loading(screen, games_dir, size, args):
+    '''
+    Time the Loading scene. The search index is built in the background
+    after loading, so wait for it before the next run, and time it
+    separately.
+
+    '''
+    results = {}
+    browse = None
+
+    def wait():
+        if browse:
+            browse.games.index.ready.wait()
+
+    def run(rescan=False):
+        nonlocal browse
+        browse = load(screen, games_dir, rescan)
+
+    if size <= args.scan_limit:
+        results['loading_rescan'] = measure(lambda: run(rescan=True), 1, wait)
+    results['loading'] = measure(run, args.repeat, wait)
+    wait()
+    games = browse.games
+    entries = list(zip(games.identifiers, games.titles, games.years))
+    results['search_index_build'] = measure(lambda: SearchIndex().build(entries), args.repeat)
+    results['gamelist_bytes_per_game'] = gamelist_memory(games_dir, entries) / size
+    return results, browse
+
+
+def gamelist_memory(games_dir, entries):
+    '''Return the number of bytes that a GameList allocates for the given games'''
+    tracemalloc.start()
+    games = GameList(games_dir)
+    for identifier, title, year in entries:
+        games.add(identifier, title, year)
+    games.sort(slideshow=0)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+
+def benchmark_gamelist(games, args):
+    games.current_game = 0
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+
+    def next_letters():
+        for _ in range(1000):
+            games.next_letter()
+
+    def jump_to_letters():
+        for letter in letters * 40:
+            games.letter(letter)
+
+    def shuffle():
+        rows = list(zip(games.keys, games.identifiers, games.titles, games.years))
+        random.shuffle(rows)
+        games.set_rows(rows)
+
+    return {
+        'gamelist_sort': measure(lambda: games.sort(slideshow=0), args.repeat, shuffle),
+        'gamelist_next_letter_1000': measure(next_letters, args.repeat),
+        'gamelist_letter_1000': measure(jump_to_letters, args.repeat),
+    }
+
+
+def benchmark_images(games, titled, args):
+    def get_images():
+        for identifier in titled:
+            games.select(identifier)
+            games.get_image()
+
+    return {
+        'get_image_cold': measure(get_images, args.repeat, games.images.clear),
+        'get_image_warm': measure(get_images, args.repeat),
+    }
+
+
+def benchmark_scaling(browse, titled, args):
+    '''
+    Time Browse.update() for title screens that have to be scaled
+    (cold) and that are in the cache of scaled images (warm). Only as
+    many title screens as fit in that cache are used, so that the warm
+    runs don't miss.
+
+    '''
+    results = {}
+
+    # Keep the background thread from scaling (and caching) title screens while update() is timed
+    browse.prescaler.worker.stop()
+
+    def update():
+        for identifier in working_set:
+            browse.games.select(identifier)
+            browse.update(screen)
+
+    for resolution in RESOLUTIONS:
+        screen = pg.display.set_mode(resolution)
+        name = f'{resolution[0]}x{resolution[1]}'
+        fits = browse.scaled_images.max_bytes // (resolution[0] * resolution[1] * 4)
+        working_set = titled[:max(fits - 1, 1)]
+        for scale in ('stretch', 'aspect', 'integer'):
+            options.scale = scale
+            results[f'browse_update_{scale}_{name}_cold'] = measure(update, args.repeat, browse.scaled_images.clear)
+            update()
+            results[f'browse_update_{scale}_{name}_warm'] = measure(update, args.repeat)
+        results[f'browse_update_{name}_titles'] = len(working_set)
+    options.scale = 'stretch'
+    return results
+
+
+def benchmark_text(screen, games, args):
+    scene = Scene()
+    loading = 'Welcome to IA Launcher!\nFound games directory at: /usr/share/games\nLoading games... 1234'
+    results = '\n'.join(f'> {title} ({year})' for title, year in zip(games.titles[:20], games.years))
+    long_line = ' '.join(games.titles[:40])
+
+    def draw(text):
+        def function():
+            for _ in range(100):
+                screen.fill((0,0,0))
+                scene.draw(screen, text)
+        return function
+
+    return {
+        'draw_loading_100': measure(draw(loading), args.repeat),
+        'draw_search_results_100': measure(draw(results), args.repeat),
+        'draw_wrapped_line_100': measure(draw(long_line), args.repeat),
+    }
+
+
+def run(size, args):
+    rng = random.Random(size)
+    games_dir = tempfile.mkdtemp(prefix=f'ialauncher-benchmark-{size}-')
+    try:
+        titled = create_games_dir(games_dir, size, size <= args.scan_limit, rng)
+        screen = pg.display.set_mode((1280, 720))
+        results, browse = benchmark_loading(screen, games_dir, size, args)
+        results.update(benchmark_gamelist(browse.games, args))
+        results.update(benchmark_images(browse.games, titled, args))
+        results.update(benchmark_scaling(browse, titled, args))
+        results.update(benchmark_text(pg.display.set_mode((1280, 720)), browse.games, args))
+        return results
+    finally:
+        shutil.rmtree(games_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the IA Launcher benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, metavar='N', help=f'Numbers of games to benchmark with (default: {SIZES})')
+    parser.add_argument('--repeat', type=int, default=5, metavar='N', help='Number of times to run each benchmark (default: 5)')
+    parser.add_argument('--scan-limit', type=int, default=30000, metavar='N', help='Only benchmark a full rescan for up to N games (default: 30000)')
+    parser.add_argument('--output', metavar='FILE', help='Write the results to FILE instead of stdout')
+    args = parser.parse_args()
+
+    # Never look for or start the real DOSBox, and don't download or watch anything
+    options.dosbox = 'true'
+    options.prewarm = 0
+    options.speculative_size = 0
+    options.watch = False
+
+    pg.init()
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'pygame': pg.version.ver,
+        'sdl': '.'.join(map(str, pg.get_sdl_version())),
+        'platform': platform.platform(),
+        'results': {},
+    }
+    for size in args.sizes:
+        print(f'Benchmarking {size} games...', file=sys.stderr)
+        report['results'][str(size)] = run(size, args)
+    pg.quit()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
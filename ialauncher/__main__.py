@@ -1,23 +1,60 @@
+import sys
 import argparse
 
-from .engine import Main
-from .scenes import Loading
+from . import cli
 from . import options
 
 
 def main():
     parser = argparse.ArgumentParser(description='DOSBox frontend for the Internet Archive MS-DOS games collection')
-    parser.add_argument('--slideshow', type=int, metavar='X', help='Focus on a random title screen every X seconds')
+    parser.add_argument('--slideshow', type=float, metavar='X', help='Focus on a random title screen every X seconds')
+    parser.add_argument('--crossfade', type=float, metavar='X', help='Fade between title screens in the slideshow for X seconds')
     parser.add_argument('--fullscreen', dest='fullscreen', action='store_true', help='Start in fullscreen mode (default)')
     parser.add_argument('--no-fullscreen', dest='no_fullscreen', action='store_true', help='Don’t start in fullscreen mode')
-    parser.add_argument('--slurp-mode', dest='slurp_mode', action='store_true', help='Slurp mode: downloads ALL games from the Internet Archive, one by one. This will take days to finish. Please don’t do this for no reason; the Internet Archive has limited bandwith. Also, consider donating first.')
+    parser.add_argument('--slurp-mode', dest='slurp_mode', action='store_true', help='Slurp mode: downloads ALL games from the Internet Archive in the background. This will take days to finish. Please don’t do this for no reason; the Internet Archive has limited bandwith. Also, consider donating first.')
+    parser.add_argument('--download-workers', type=int, metavar='N', help=f'Number of games to download at the same time (default: {options.download_workers})')
+    parser.add_argument('--bandwidth-limit', type=int, metavar='KB', help='Limit the total download speed to KB kilobytes per second')
+    parser.add_argument('--delete-archives', dest='keep_archives', action='store_false', help='Delete downloaded archives after extracting them (saves disk space, but resetting a game will download it again)')
+    parser.add_argument('--disk-quota', type=int, metavar='MB', help='Delete the least recently played games when the downloaded games take more than MB megabytes')
+    parser.add_argument('--speculative-size', type=int, metavar='MB', help=f'With --disk-quota, download games next to the current one in advance if they are smaller than MB megabytes, 0 to disable (default: {options.speculative_size})')
+    parser.add_argument('--evict-saves', action='store_true', help='Allow --disk-quota to delete games with save data')
+    parser.add_argument('--dedup', action='store_true', help='Store identical files of different games only once, using reflinks or hardlinks (not on Windows). Hardlinked games get their own copy when they are played.')
+    parser.add_argument('--scale', choices=['stretch', 'aspect', 'integer'], help='How to scale title screens to the screen size (default: stretch)')
+    parser.add_argument('--dosbox', metavar='COMMAND', help='Command to run DOSBox with (default: search for it)')
+    parser.add_argument('--timings', action='store_true', help='Record frame timings, show them with F12 and print them on exit')
+    parser.add_argument('--profile', action='store_true', help='Profile each screen with cProfile and print the results on exit (implies --timings)')
+    parser.add_argument('--smooth', action='store_true', help='Smooth title screens when scaling them up')
+    parser.add_argument('--aspect-correction', action='store_true', help='Show title screens with a 4:3 aspect ratio, like on a CRT monitor (with --scale aspect)')
+    parser.add_argument('--prewarm', type=int, metavar='N', help=f'Download the N most played games in advance (default: {options.prewarm})')
+    parser.add_argument('--rescan', action='store_true', help='Rescan the games directory instead of trusting the catalog')
+    cli.add_subcommands(parser)
     args = parser.parse_args()
 
     if args.fullscreen ^ args.no_fullscreen:
         options.fullscreen = args.fullscreen or not args.no_fullscreen
     options.slideshow = args.slideshow or options.slideshow
+    options.crossfade = args.crossfade or options.crossfade
+    options.scale = args.scale or options.scale
+    options.download_workers = args.download_workers or options.download_workers
+    options.bandwidth_limit = args.bandwidth_limit or options.bandwidth_limit
+    options.keep_archives = args.keep_archives and options.keep_archives
+    options.disk_quota = args.disk_quota or options.disk_quota
+    options.speculative_size = options.speculative_size if args.speculative_size is None else args.speculative_size
+    options.evict_saves = args.evict_saves or options.evict_saves
+    options.dedup = args.dedup or options.dedup
+    options.dosbox = args.dosbox or options.dosbox
+    options.prewarm = options.prewarm if args.prewarm is None else args.prewarm
+    options.smooth = args.smooth or options.smooth
+    options.aspect_correction = args.aspect_correction or options.aspect_correction
+    options.profile = args.profile or options.profile
+    options.timings = args.timings or options.profile or options.timings
 
-    Main(Loading(slurp_mode=args.slurp_mode), title='IA Launcher', fullscreen=options.fullscreen)
+    if args.command:
+        sys.exit(cli.run(args))
+
+    from .engine import Main
+    from .scenes import Loading
+    Main(Loading(slurp_mode=args.slurp_mode, rescan=args.rescan), title='IA Launcher', fullscreen=options.fullscreen)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,140 @@
+'''
+The catalog is a single file that contains the metadata of all the
+games in the games directory, so that IA Launcher doesn't have to
+open and parse thousands of metadata.ini files at startup.
+
+The catalog remembers the modification time of the games directory
+itself. As long as that hasn't changed, the catalog is used as-is,
+which costs only one read and one stat. Otherwise, the games
+directory is scanned and only the metadata.ini files that were
+added or changed since the last scan are read again.
+
+Editing a metadata.ini in place doesn't change the modification time
+of the games directory. Those edits are picked up by the watcher (see
+watcher.py) after startup, and by scan(), which the command-line
+interface always runs.
+
+'''
+import os
+import json
+from configparser import RawConfigParser
+
+VERSION = 1
+FILENAME = 'catalog.json'
+FIELDS = ['title', 'year', 'urls', 'emulator_start', 'dosbox_conf']
+
+
+def read_metadata(path):
+    '''Read a game's metadata.ini and return its fields as a dict'''
+    c = RawConfigParser()
+    c.read(os.path.join(path, 'metadata.ini'))
+    metadata = {field: c['metadata'].get(field) for field in FIELDS}
+    metadata['urls'] = c['metadata'].get('url').split()
+    return metadata
+
+
+def find_games(games_dir):
+    '''Return a dict of identifier -> modification time of metadata.ini'''
+    found = {}
+    for entry in os.scandir(games_dir):
+        try:
+            found[entry.name] = os.stat(os.path.join(entry.path, 'metadata.ini')).st_mtime_ns
+        except OSError:
+            pass
+    return found
+
+
+class Catalog:
+    def __init__(self, games_dir):
+        self.games_dir = games_dir
+        self.path = os.path.join(games_dir, FILENAME)
+        self.mtime = None
+        self.entries = {}
+
+    def load(self):
+        '''
+        Load the catalog from disk. Returns True if the catalog is
+        up-to-date, False if the games directory needs to be scanned.
+
+        '''
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data['version'] == VERSION:
+                self.mtime = data['mtime']
+                self.entries = data['games']
+        except:
+            pass
+        return self.mtime == os.stat(self.games_dir).st_mtime_ns
+
+    def save(self):
+        data = {
+            'version': VERSION,
+            'mtime': self.mtime,
+            'games': self.entries,
+        }
+        tmpfile = self.path + '.tmp'
+        try:
+            mtime = os.stat(self.games_dir).st_mtime_ns
+            with open(tmpfile, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(tmpfile, self.path)
+
+            # Writing the catalog changes the mtime of the games directory
+            # itself. If nothing else changed it, record the new mtime, by
+            # overwriting the file in place (which leaves the mtime as is).
+            if self.mtime == mtime:
+                data['mtime'] = self.mtime = os.stat(self.games_dir).st_mtime_ns
+                with open(self.path, 'w') as f:
+                    json.dump(data, f, separators=(',', ':'))
+        except OSError:
+            print('Could not write', self.path)
+
+    def scan(self):
+        '''
+        Scan the games directory and return the identifiers of all
+        games that need to be (re)read. Entries of games that no
+        longer exist are removed from the catalog.
+
+        '''
+        self.mtime = os.stat(self.games_dir).st_mtime_ns
+        found = find_games(self.games_dir)
+
+        self.entries = {
+            identifier: entry for identifier, entry in self.entries.items()
+            if identifier in found
+        }
+        return [
+            identifier for identifier, mtime in found.items()
+            if identifier not in self.entries or self.entries[identifier][0] != mtime
+        ]
+
+    def read(self, identifier):
+        '''(Re)read the metadata.ini of a single game'''
+        path = os.path.join(self.games_dir, identifier)
+        try:
+            mtime = os.stat(os.path.join(path, 'metadata.ini')).st_mtime_ns
+            metadata = read_metadata(path)
+        except:
+            print('Error loading', identifier)
+            self.entries.pop(identifier, None)
+            return
+        self.entries[identifier] = [mtime] + [metadata[field] for field in FIELDS]
+
+    def update(self, identifier):
+        '''Update a single entry of the catalog on disk'''
+        fresh = self.load()
+        self.read(identifier)
+        if not fresh:
+            self.mtime = None
+        self.save()
+
+    def metadata(self, identifier):
+        '''Return the metadata of a game as a dict'''
+        return dict(zip(FIELDS, self.entries[identifier][1:]))
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
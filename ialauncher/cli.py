@@ -0,0 +1,172 @@
+'''
+Subcommands that work without a display, so that kiosk images can be
+provisioned from scripts:
+
+    ialauncher list [--downloaded]
+    ialauncher search QUERY
+    ialauncher prefetch [--all] [IDENTIFIER ...]
+    ialauncher verify [--thorough] [IDENTIFIER ...]
+
+prefetch downloads games in a pool of threads that share the
+bandwidth limit, and verify checks the files of each game against its
+manifest in a pool of processes.
+
+'''
+import os, sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import games as gd
+
+from .catalog import Catalog
+from .search import SearchIndex
+from .game import Game
+from .scheduler import Throttle
+from . import manifest
+from . import options
+
+
+def add_subcommands(parser):
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND', help='Run a command instead of starting the user interface')
+
+    p = subparsers.add_parser('list', help='List all games')
+    p.add_argument('--downloaded', action='store_true', help='Only list games that have been downloaded')
+
+    p = subparsers.add_parser('search', help='Search for games by title, identifier or year')
+    p.add_argument('query', nargs='+')
+    p.add_argument('--limit', type=int, default=20, metavar='N', help='Show at most N results (default: 20)')
+
+    p = subparsers.add_parser('prefetch', help='Download games')
+    p.add_argument('identifiers', nargs='*', metavar='IDENTIFIER')
+    p.add_argument('--all', action='store_true', help='Download all games')
+    p.add_argument('--jobs', type=int, metavar='N', help=f'Number of games to download at the same time (default: {options.download_workers})')
+
+    p = subparsers.add_parser('verify', help='Check that downloaded games are complete')
+    p.add_argument('identifiers', nargs='*', metavar='IDENTIFIER', help='Games to check (default: all downloaded games)')
+    p.add_argument('--thorough', action='store_true', help='Compare checksums instead of just file sizes')
+    p.add_argument('--jobs', type=int, metavar='N', help='Number of processes (default: number of CPUs)')
+
+
+def run(args):
+    '''Run the subcommand and return the exit status'''
+    games_dir = os.path.dirname(gd.__file__)
+    catalog = Catalog(games_dir)
+    fresh = catalog.load()
+
+    # Without a window, checking every metadata.ini for edits is affordable
+    outdated = catalog.scan()
+    for identifier in outdated:
+        catalog.read(identifier)
+    if outdated or not fresh:
+        catalog.save()
+
+    commands = {
+        'list': list_games,
+        'search': search,
+        'prefetch': prefetch,
+        'verify': verify,
+    }
+    return commands[args.command](catalog, args)
+
+
+def is_downloaded(catalog, identifier):
+    return os.path.isdir(os.path.join(catalog.games_dir, identifier, 'dosbox_drive_c'))
+
+
+def print_game(catalog, identifier):
+    metadata = catalog.metadata(identifier)
+    print(f'{identifier}\t{metadata["year"] or ""}\t{metadata["title"]}')
+
+
+def select(catalog, identifiers):
+    '''Return the given identifiers that exist in the catalog'''
+    selected = []
+    for identifier in identifiers:
+        if identifier in catalog.entries:
+            selected.append(identifier)
+        else:
+            print('Unknown game:', identifier, file=sys.stderr)
+    return selected
+
+
+def list_games(catalog, args):
+    for identifier in sorted(catalog, key=str.lower):
+        if not args.downloaded or is_downloaded(catalog, identifier):
+            print_game(catalog, identifier)
+    return 0
+
+
+def search(catalog, args):
+    entries = []
+    for identifier in catalog:
+        metadata = catalog.metadata(identifier)
+        entries.append((identifier, metadata['title'], metadata['year']))
+    index = SearchIndex()
+    index.build(entries)
+    for identifier in index.search(' '.join(args.query), args.limit):
+        print_game(catalog, identifier)
+    return 0
+
+
+def prefetch(catalog, args):
+    if args.all:
+        identifiers = [identifier for identifier in sorted(catalog) if not is_downloaded(catalog, identifier)]
+    else:
+        identifiers = select(catalog, args.identifiers)
+    throttle = Throttle(options.bandwidth_limit * 1000)
+
+    def download(identifier):
+        game = Game(os.path.join(catalog.games_dir, identifier), catalog.metadata(identifier))
+        if not os.path.isdir(game.gamedir):
+            game.download_now(throttle)
+        return identifier, os.path.isdir(game.gamedir)
+
+    failed = 0
+    with ThreadPoolExecutor(args.jobs or options.download_workers) as executor:
+        for identifier, ok in executor.map(download, identifiers):
+            print(f'{identifier}: {"ok" if ok else "failed"}')
+            failed += not ok
+    print(f'Downloaded {len(identifiers) - failed} of {len(identifiers)} games')
+    return 1 if failed or len(identifiers) < len(args.identifiers) else 0
+
+
+def verify_game(path, thorough):
+    '''Return the status of the game at path and a list of details'''
+    gamedir = os.path.join(path, 'dosbox_drive_c')
+    if not os.path.isdir(gamedir):
+        return 'not downloaded', []
+    files = manifest.load(path)
+    if files is None:
+
+        # Games downloaded before manifests existed can be checked against their archives
+        archives = [os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(('.zip', '.play'))]
+        if not archives:
+            return 'unknown', ['no manifest or archive to compare with']
+        files = {}
+        for archive in archives:
+            try:
+                files.update(manifest.from_zipfile(archive, gamedir))
+            except:
+                return 'unknown', [f'cannot read {os.path.basename(archive)}']
+    missing, changed = manifest.check(gamedir, files, thorough)
+    if missing:
+        return 'incomplete', [f'missing {name}' for name in missing]
+    if changed:
+        return 'changed', [f'changed {name}' for name in changed]
+    return 'ok', []
+
+
+def verify(catalog, args):
+    if args.identifiers:
+        identifiers = select(catalog, args.identifiers)
+    else:
+        identifiers = [identifier for identifier in sorted(catalog) if is_downloaded(catalog, identifier)]
+    paths = [os.path.join(catalog.games_dir, identifier) for identifier in identifiers]
+
+    bad = 0
+    with ProcessPoolExecutor(args.jobs) as executor:
+        for identifier, (status, details) in zip(identifiers, executor.map(verify_game, paths, [args.thorough] * len(paths), chunksize=16)):
+            print(f'{identifier}: {status}')
+            for detail in details:
+                print(f'    {detail}')
+            bad += status in ('not downloaded', 'incomplete')
+    return 1 if bad or len(identifiers) < len(args.identifiers) else 0
@@ -1,37 +1,74 @@
-import os, glob, subprocess
+'''
+Find the DOSBox executable.
+
+Probing means running candidates with --version, which is slow,
+so it is only done when the first game starts. The result is cached
+on disk together with the mtime of the binary, and probed again when
+the binary changes or disappears. Use --dosbox to skip all this.
+
+'''
+import os, glob, json, shlex, shutil, subprocess
+from threading import Lock
+
+from . import options
+
+CACHE_FILE = 'dosbox.json'
+lock = Lock()
+dosbox = None
 
 
 class DOSBoxNotFound(Exception):
     pass
 
 
-def try_command(command):
-    subprocess.run(command + ['--version'], capture_output=True).check_returncode()
-    return command
-
+def candidates():
+    '''Return the possible DOSBox commands, in order of preference'''
+    commands = [
+        ['dosbox'],
 
-def get_dosbox_path():
-    try:
-        return try_command(['dosbox'])
-    except:
-        pass
-    try:
         # Proper way to do it on macOS
-        return try_command(['open', '-a', 'DOSBox', '--args'])
-    except:
-        pass
-    try:
+        ['open', '-a', 'DOSBox', '--args'],
+
         # Fallback to hardcoded path on macOS
-        return try_command(['/Applications/dosbox.app/Contents/MacOS/DOSBox'])
+        ['/Applications/dosbox.app/Contents/MacOS/DOSBox'],
+    ]
+
+    # Special case for Windows
+    if pf := os.environ.get('ProgramFiles(x86)'):
+        commands.extend([path] for path in glob.glob(f'{pf}\\dosbox*\\dosbox.exe')[:1])
+    return commands
+
+
+def try_command(command):
+    '''Return command if it runs, or None'''
+    if not binary_mtime(command):
+        return None
+    try:
+        subprocess.run(command + ['--version'], capture_output=True).check_returncode()
+        return command
     except:
-        pass
+        return None
+
+
+def binary_mtime(command):
+    '''Return the path and mtime of the binary that command runs, or None'''
     try:
-        # Special case for Windows
-        pf = os.environ['ProgramFiles(x86)']
-        path = glob.glob(f'{pf}\dosbox*\dosbox.exe')[0]
-        return try_command([path])
+        path = shutil.which(command[0])
+        return path, os.stat(path).st_mtime
     except:
-        pass
+        return None
+
+
+def probe():
+    '''
+    Try the candidates in order of preference and return the first one
+    that works. They're tried one by one, so that app bundles aren't
+    started when plain dosbox works.
+
+    '''
+    for command in candidates():
+        if try_command(command):
+            return command
 
     raise DOSBoxNotFound("""
 
@@ -40,3 +77,41 @@ Uh-oh! The program DOSBox could not be found on your system. IA Launcher acts as
 Please visit https://www.dosbox.com/ to learn more about DOSBox and download the correct installer for your operating system.
 
 """)
+
+
+def load_cache(cachefile):
+    try:
+        with open(cachefile, 'r') as f:
+            cache = json.load(f)
+        if binary_mtime(cache['command']) == tuple(cache['binary']):
+            return cache['command']
+    except:
+        return None
+
+
+def save_cache(cachefile, command):
+    try:
+        os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+        with open(cachefile + '.tmp', 'w') as f:
+            json.dump({'command': command, 'binary': binary_mtime(command)}, f)
+        os.replace(cachefile + '.tmp', cachefile)
+    except OSError:
+        pass
+
+
+def get_dosbox_path():
+    '''Return the DOSBox command as a list, probing for it only once'''
+    global dosbox
+    with lock:
+        if dosbox:
+            return dosbox
+        if options.dosbox:
+            dosbox = shlex.split(options.dosbox)
+            return dosbox
+
+        cachefile = os.path.join(options.cache_dir, CACHE_FILE)
+        dosbox = load_cache(cachefile)
+        if not dosbox:
+            dosbox = probe()
+            save_cache(cachefile, dosbox)
+        return dosbox
@@ -20,8 +20,15 @@ subclassed by your own custom scenes. Example usage:
         Main(scene, title='My awesome game')
 
 '''
+import time
 import pygame as pg
 
+from .profiling import timed, timings, run_scene, dump
+from .text import get_font
+from . import options
+
+REFRESH = pg.event.custom_type()
+
 
 class Main:
     '''
@@ -45,7 +52,8 @@ class Main:
 
         while scene:
             pg.event.clear()
-            scene = scene.run(screen)
+            scene = run_scene(scene, screen)
+        dump()
 
 
 class Scene:
@@ -53,10 +61,21 @@ class Scene:
     Base class for scenes. Subclasses are meant to override the
     handle() and update() methods.
 
+    To save CPU time, update() is only called when the scene has
+    been invalidated, for example because the window was exposed or
+    because the scene called invalidate() while handling an event.
+    Otherwise, the scene sleeps until the next event arrives. Set
+    `refresh_rate` to have the scene updated a few times per second
+    regardless.
+
     '''
+    fps = 60
+    refresh_rate = 0
 
     def __init__(self):
         self.clock = pg.time.Clock()
+        self.dirty = True
+        self.dirty_rects = []
 
     def handle(self, event):
         raise NotImplementedError()
@@ -64,9 +83,58 @@ class Scene:
     def update(self, screen):
         raise NotImplementedError()
 
+    def invalidate(self, rect=None):
+        '''
+        Request a call to update(). If a rect is given, only that part
+        of the screen is updated afterwards.
+
+        '''
+        if rect is None:
+            self.dirty = True
+        else:
+            self.dirty_rects.append(pg.Rect(rect))
+
     def get_events(self):
-        self.clock.tick(60)
-        return pg.event.get()
+        if self.dirty or self.dirty_rects:
+            self.clock.tick(self.fps)
+            return pg.event.get()
+        return [pg.event.wait()]
+
+    def redraw(self, screen):
+        '''
+        Call update() if needed and update the (changed parts of the)
+        display. Returns the result of update().
+
+        '''
+        start = time.perf_counter()
+        dirty, dirty_rects = self.dirty, self.dirty_rects
+        self.dirty, self.dirty_rects = False, []
+        with timed('update'):
+            next_scene = self.update(screen)
+        if timings.overlay and dirty:
+            self.draw_timings(screen)
+        with timed('flip'):
+            if dirty:
+                pg.display.flip()
+            else:
+                pg.display.update(dirty_rects)
+        if options.timings:
+            timings.frame(time.perf_counter() - start)
+        return next_scene
+
+    def draw_timings(self, screen):
+        '''Draw the recorded timings on top of the scene (toggled with F12)'''
+        if not hasattr(self, 'timings_font'):
+            self.timings_font = pg.font.SysFont('monospace', 14)
+        lines = [self.timings_font.render(line, True, (255,255,0)) for line in timings.report().split('\n')]
+        height = sum(line.get_height() for line in lines)
+        background = pg.Surface((max(line.get_width() for line in lines) + 10, height + 10), pg.SRCALPHA)
+        background.fill((0,0,0,192))
+        screen.blit(background, (0,0))
+        ypos = 5
+        for line in lines:
+            screen.blit(line, (5, ypos))
+            ypos += line.get_height()
 
     def run(self, screen):
         '''
@@ -75,43 +143,46 @@ class Scene:
 
         '''
         self.screen = screen
-        next_scene = None
-        while next_scene is None:
-            next_scene = self.update(screen)
-            pg.display.flip()
-            for event in self.get_events():
-                if event.type == pg.QUIT:
-                    return
-                next_scene = self.handle(event)
-
-        return next_scene
+        self.invalidate()
+        if self.refresh_rate:
+            pg.time.set_timer(REFRESH, 1000 // self.refresh_rate)
+        try:
+            while True:
+                if self.dirty or self.dirty_rects:
+                    next_scene = self.redraw(screen)
+                    if next_scene is not None:
+                        return next_scene
+                for event in self.get_events():
+                    if event.type == pg.QUIT:
+                        return
+                    if event.type in (REFRESH, pg.VIDEORESIZE, pg.VIDEOEXPOSE):
+                        self.invalidate()
+                    if event.type == pg.KEYDOWN and event.key == pg.K_F12 and options.timings:
+                        timings.overlay = not timings.overlay
+                        self.invalidate()
+                        continue
+                    with timed('events'):
+                        next_scene = self.handle(event)
+                    if next_scene is not None:
+                        return next_scene
+        finally:
+            if self.refresh_rate:
+                pg.time.set_timer(REFRESH, 0)
 
     def draw(self, surface, text, margin=15, font_size=24, line_height=1.25, font_family='monospace', color=(255,255,255)):
         '''
-        Simple text drawing routine, adapted from
-        https://www.pygame.org/wiki/TextWrap
+        Draw text on the surface, wrapped to its width. The layout and
+        the rendered lines are cached, so redrawing the same (or nearly
+        the same) text is cheap.
 
         '''
-        if not hasattr(self, 'font'):
-            self.font = pg.font.SysFont(font_family, font_size)
+        font = get_font(font_family, font_size)
         rect = surface.get_rect()
         ypos = margin
         yinc = int(line_height * font_size)
 
-        for line in text.split('\n'):
+        for line in font.wrap(text, rect.width - 2*margin):
             if ypos + yinc > rect.bottom:
                 break
-            while line:
-                i = 0
-
-                # Determine maximum width of line
-                while self.font.size(line[:i])[0] + 2*margin < rect.width and i < len(line):
-                    i += 1
-
-                # Render the line and blit it to the surface
-                image = self.font.render(line[:i], True, color)
-                surface.blit(image, (margin, ypos))
-                ypos += yinc
-
-                # Remove the text we just blitted
-                line = line[i:]
+            surface.blit(font.render(line, color), (margin, ypos))
+            ypos += yinc
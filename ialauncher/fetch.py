@@ -0,0 +1,269 @@
+'''
+Resumable downloads over multiple connections.
+
+If the server supports HTTP Range requests, a file is split into
+segments that are downloaded in parallel. Data is written to a
+".part" file next to the destination, and the progress of each
+segment is kept in a ".part.json" file, so that an interrupted
+download continues where it left off. Failed requests are retried
+with exponential backoff. Only when all bytes have arrived is the
+part file renamed to its final name, so a file that exists is
+always complete.
+
+'''
+import os
+import json
+from threading import Thread, Condition, Event
+from urllib import request
+from urllib.error import HTTPError
+
+from .profiling import timed
+
+CHUNK_SIZE = 64 * 1024
+MIN_SEGMENT_SIZE = 1024 * 1024
+MAX_BACKOFF = 60
+
+
+class DownloadError(Exception):
+    pass
+
+
+def should_retry(error):
+    '''Client errors (except timeouts and rate limiting) are permanent'''
+    if isinstance(error, HTTPError):
+        return error.code >= 500 or error.code in (408, 429)
+    return True
+
+
+class Fetch:
+    def __init__(self, url, dest, connections=4, retries=5, timeout=30, throttle=None, progress=None):
+        self.url = url
+        self.dest = dest
+        self.part = dest + '.part'
+        self.statefile = dest + '.part.json'
+        self.connections = connections
+        self.retries = retries
+        self.timeout = timeout
+        self.throttle = throttle
+        self.progress = progress
+        self.size = None
+        self.ranges = False
+        self.segments = []
+        self.errors = []
+        self.lock = Condition()
+        self.done = Event()
+        self.cancelled = Event()
+
+    def run(self):
+        '''Download the file, resuming a previous attempt if possible'''
+        self.download()
+        self.join()
+        self.commit()
+
+    def start(self):
+        '''
+        Download the file in a background thread. Use available() and
+        wait() to follow its progress, join() to wait until it is
+        done, and commit() to give the file its final name.
+
+        '''
+        Thread(target=self.download, daemon=True).start()
+
+    def join(self):
+        self.done.wait()
+        if self.errors:
+            raise DownloadError(f'Could not download {self.url}: {self.errors[0]}')
+
+    def cancel(self):
+        '''Stop a download that was started, keeping what arrived so far for a next attempt'''
+        self.cancelled.set()
+
+    def download(self):
+        try:
+            self.download_segments()
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            with self.lock:
+                self.done.set()
+                self.lock.notify_all()
+
+    def download_segments(self):
+        self.probe()
+        if not self.load_state():
+            self.create_segments()
+        if self.progress:
+            self.progress.start('download', self.url, self.size, self.received())
+
+        threads = [
+            Thread(target=self.run_segment, args=(segment,), daemon=True)
+            for segment in self.segments if segment[2] is None or segment[1] < segment[2]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+                self.save_state()
+        if self.errors:
+            self.save_state()
+
+    def commit(self):
+        '''Rename the completely downloaded file to its final name'''
+        os.replace(self.part, self.dest)
+        try:
+            os.remove(self.statefile)
+        except FileNotFoundError:
+            pass
+
+    def open(self, headers={}):
+        req = request.Request(self.url, headers=headers)
+        return request.urlopen(req, timeout=self.timeout)
+
+    def retry(self, function, *args):
+        '''
+        Call function until it succeeds, with exponential backoff in
+        between. Attempts that make progress don't count towards the
+        maximum number of retries.
+
+        '''
+        attempt = 0
+        while True:
+            received = self.received()
+            try:
+                return function(*args)
+            except Exception as e:
+                if self.received() > received:
+                    attempt = 0
+                attempt += 1
+                if attempt > self.retries or not should_retry(e) or self.cancelled.is_set():
+                    raise
+                print(f'Retrying {self.url} ({e})')
+                self.cancelled.wait(min(2 ** attempt, MAX_BACKOFF))
+
+    def received(self):
+        '''Return the number of bytes downloaded so far'''
+        with self.lock:
+            return sum(position - start for start, position, end in self.segments)
+
+    def available(self):
+        '''Return the number of bytes at the start of the file that have arrived'''
+        with self.lock:
+            available = 0
+            for start, position, end in sorted(self.segments):
+                if start > available:
+                    break
+                available = position
+            return available
+
+    def wait(self, nbytes):
+        '''
+        Wait until the first nbytes of the file have arrived, or the
+        download has ended. Returns the number of available bytes.
+
+        '''
+        with self.lock:
+            while self.available() < nbytes and not self.done.is_set():
+                self.lock.wait()
+            return self.available()
+
+    def probe(self):
+        '''Find out the size of the file and whether Range requests are supported'''
+        with self.retry(self.open, {'Range': 'bytes=0-0'}) as response:
+            total = (response.headers['Content-Range'] or '').split('/')[-1]
+            if response.status == 206 and total.isdigit():
+                self.ranges = True
+                self.size = int(total)
+            elif response.headers['Content-Length']:
+                self.size = int(response.headers['Content-Length'])
+
+    def load_state(self):
+        '''Load the progress of a previous attempt. Returns True if it can be resumed.'''
+        try:
+            with open(self.statefile, 'r') as f:
+                state = json.load(f)
+            if not os.path.isfile(self.part):
+                return False
+        except (OSError, ValueError):
+            return False
+        if state['url'] != self.url or state['size'] != self.size:
+            return False
+        if not self.ranges:
+            return False
+        self.segments = state['segments']
+        return True
+
+    def save_state(self):
+        with self.lock:
+            state = {
+                'url': self.url,
+                'size': self.size,
+                'segments': [list(segment) for segment in self.segments],
+            }
+        with open(self.statefile, 'w') as f:
+            json.dump(state, f)
+
+    def create_segments(self):
+        '''
+        Divide the file into segments of [start, position, end]. If
+        the server doesn't support Range requests or the size is
+        unknown, there is only one segment.
+
+        '''
+        count = 1
+        if self.ranges and self.size:
+            count = max(1, min(self.connections, self.size // MIN_SEGMENT_SIZE))
+        if self.size is None:
+            self.segments = [[0, 0, None]]
+        else:
+            bounds = [self.size * i // count for i in range(count + 1)]
+            self.segments = [[start, start, end] for start, end in zip(bounds, bounds[1:])]
+        with open(self.part, 'wb') as f:
+            if self.size:
+                f.truncate(self.size)
+
+    def run_segment(self, segment):
+        try:
+            self.retry(self.fetch_segment, segment)
+        except Exception as e:
+            self.errors.append(e)
+
+    def fetch_segment(self, segment):
+        start, position, end = segment
+        headers = {}
+        if self.ranges:
+            headers['Range'] = f'bytes={position}-{end - 1}'
+        elif position:
+            with self.lock:
+                segment[1] = position = 0
+
+        with self.open(headers) as response, open(self.part, 'r+b') as f:
+            if self.ranges and response.status != 206:
+                raise DownloadError('Server ignored Range request')
+            f.seek(position)
+            while end is None or segment[1] < end:
+                if self.cancelled.is_set():
+                    raise DownloadError('Cancelled')
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                with timed('download'):
+                    if end is not None:
+                        chunk = chunk[:end - segment[1]]
+                    f.write(chunk)
+                    f.flush()
+                    with self.lock:
+                        segment[1] += len(chunk)
+                        self.lock.notify_all()
+                    if self.progress:
+                        self.progress.update(self.received())
+                if self.throttle:
+                    self.throttle(len(chunk))
+            if end is None:
+                f.truncate()
+
+        if end is None:
+            segment[2] = segment[1]
+        elif segment[1] < end:
+            raise DownloadError('Connection closed early')
+
@@ -1,39 +1,57 @@
 import os, sys
+import time
 import shutil
 import subprocess
 from zipfile import ZipFile
-from urllib import request
 from urllib.parse import unquote
 from configparser import RawConfigParser
-from threading import Thread
+from threading import Thread, Lock
 
 from .dosbox import get_dosbox_path
-
-DOSBOX = get_dosbox_path()
+from .catalog import Catalog, read_metadata
+from .fetch import Fetch
+from .unzip import PartReader, Unsupported, stream_extract, safe_path
+from .store import get_store
+from .progress import Progress
+from . import manifest
+from .logs import get_logger, record_launch
+from .stats import stats
+from .scheduler import scheduler, URGENT
+from . import options
+
+LOCKFILE = 'dosbox.lock'
 
 class Game:
-    def __init__(self, path):
+    def __init__(self, path, metadata=None):
         self.path = path
         self.gamedir = os.path.join(self.path, 'dosbox_drive_c')
         self.identifier = os.path.basename(path)
+        self.sort_key = self.identifier.lower()
         self.configured = False
-        self.download_thread = None
-
-    def configure(self):
-        self.config = c = RawConfigParser()
-        c.read(os.path.join(self.path, 'metadata.ini'))
-        self.title = c['metadata'].get('title')
-        self.year = c['metadata'].get('year')
-        self.emulator_start = c['metadata'].get('emulator_start')
-        self.dosbox_conf = c['metadata'].get('dosbox_conf')
-        self.urls = c['metadata'].get('url').split()
+        self.progress = None
+        if metadata:
+            self.configure(metadata)
+
+    def configure(self, metadata=None):
+        '''
+        Set the game's metadata, either from the given dict (usually
+        provided by the catalog) or by reading metadata.ini.
+
+        '''
+        if metadata is None:
+            metadata = read_metadata(self.path)
+        self.title = metadata['title']
+        self.year = metadata['year']
+        self.emulator_start = metadata['emulator_start']
+        self.dosbox_conf = metadata['dosbox_conf']
+        self.urls = metadata['urls']
         self.configured = True
 
     def __gt__(self, other):
-        return self.identifier.lower() > other.identifier.lower()
+        return self.sort_key > other.sort_key
 
     def __lt__(self, other):
-        return self.identifier.lower() < other.identifier.lower()
+        return self.sort_key < other.sort_key
 
     def start(self, autorun=True):
         """
@@ -61,10 +79,29 @@ class Game:
         is run normally.
 
         """
+        requested = time.monotonic()
+        self.dosbox = get_dosbox_path()
+        if not DOSBox.register(self):
+            print(f'{self.identifier} is already running')
+            return
+        try:
+            self.prepare(autorun)
+        except:
+            DOSBox.unregister(self)
+            raise
+        DOSBox(self, requested).start()
+
+    def prepare(self, autorun):
+        '''Write dosbox.bat and dosbox.conf and work out how to start DOSBox'''
         batfile = os.path.join(self.gamedir, 'dosbox.bat')
         conffile = os.path.join(self.gamedir, 'dosbox.conf')
         dosbox_args = [self.gamedir, '-fullscreen']
 
+        # The rest of the game is unshared by the DOSBox thread
+        if store := get_store(os.path.dirname(self.path)):
+            for path in (batfile, conffile):
+                store.unshare(path)
+
         if self.dosbox_conf:
             with open(conffile, 'w') as f:
                 f.write(self.dosbox_conf)
@@ -105,23 +142,25 @@ class Game:
         self.batfile = batfile
         self.autorun = autorun
         self.dosbox_args = dosbox_args
-        DOSBox(self).start()
 
 
     def write_metadata(self):
+        inifile = os.path.join(self.path, 'metadata.ini')
+        config = RawConfigParser()
+        config.read(inifile)
         if self.title:
-            self.config['metadata']['title'] = self.title
+            config['metadata']['title'] = self.title
         if self.year:
-            self.config['metadata']['year'] = self.year
+            config['metadata']['year'] = self.year
         if self.urls:
-            self.config['metadata']['url'] = '\n'.join(self.urls)
+            config['metadata']['url'] = '\n'.join(self.urls)
         if self.emulator_start:
-            self.config['metadata']['emulator_start'] = self.emulator_start
+            config['metadata']['emulator_start'] = self.emulator_start
         if self.dosbox_conf:
-            self.config['metadata']['dosbox_conf'] = self.dosbox_conf
-        inifile = os.path.join(self.path, 'metadata.ini')
+            config['metadata']['dosbox_conf'] = self.dosbox_conf
         with open(inifile, 'w') as f:
-            self.config.write(f)
+            config.write(f)
+        Catalog(os.path.dirname(self.path)).update(self.identifier)
 
     def get_titlescreen(self):
         path = os.path.join(self.path, 'title.png')
@@ -136,44 +175,138 @@ class Game:
                 self.configure()
             except:
                 return False
-        return os.path.isdir(self.gamedir)
-
-    def get_size(self):
-        return sum(os.path.getsize(os.path.join(self.path, f)) for f in os.listdir(self.path) if os.path.isfile(os.path.join(self.path, f)))/1000000
+        return os.path.isdir(self.gamedir) and not self.download_in_progress()
 
     def reset(self):
-        try:
-            shutil.rmtree(self.gamedir)
-        except:
-            pass
+        for path in (self.gamedir, self.gamedir + '.part'):
+            shutil.rmtree(path, ignore_errors=True)
+        manifest.remove(self.path)
+        stats.record_download(self.identifier, False)
+        if store := get_store(os.path.dirname(self.path)):
+            store.collect()
+
+    def archives(self):
+        '''Return the paths that the game's files are (or would be) downloaded to'''
+        if not self.configured:
+            try:
+                self.configure()
+            except:
+                return []
+        return [os.path.join(self.path, archive_filename(url)) for url in self.urls]
 
-    def download(self):
+    def download(self, priority=URGENT):
+        '''Have the scheduler download the game (in another thread)'''
         if not self.configured:
             try:
                 self.configure()
             except:
                 return
-        self.download_thread = Download(self.urls, self.gamedir)
-        self.download_thread.start()
+        if not self.download_in_progress():
+            self.progress = Progress(self.title or self.identifier)
+        scheduler.submit(self, priority)
+
+    def download_now(self, throttle=None):
+        if not self.configured:
+            self.configure()
+        if os.path.isdir(self.gamedir):
+
+            # The game directory only appears when a download completes
+            return
+        if not self.progress:
+            self.progress = Progress(self.title or self.identifier)
+        Download(self.urls, self.gamedir, throttle, self.progress).run()
 
     def download_in_progress(self):
-        if self.configured and self.download_thread:
-            return self.download_thread.is_alive()
+        return scheduler.is_busy(self)
 
     def download_completed(self):
         return not self.download_in_progress()
 
 
 class DOSBox(Thread):
-    def __init__(self, game):
+    '''
+    Runs DOSBox for a game, streaming its output to the game's log file
+    (see logs.py) instead of keeping it in memory. Only one DOSBox can
+    run per game: register() refuses a game that is already running,
+    in this process or in another one. The latter holds a lock on the
+    game's lock file, which the operating system releases when that
+    process exits, however it exits.
+
+    '''
+    running = {}
+    lock = Lock()
+
+    def __init__(self, game, requested):
         self.game = game
+        self.requested = requested
         super().__init__(daemon=True)
 
+    @classmethod
+    def register(cls, game):
+        '''Mark the game as running. Returns False if it already was.'''
+        with cls.lock:
+            if game.identifier in cls.running:
+                return False
+            try:
+                f = open(os.path.join(game.path, LOCKFILE), 'a')
+            except OSError:
+
+                # Without a lock file, only this process is checked
+                f = None
+            if f and not lock_file(f):
+                f.close()
+                return False
+            cls.running[game.identifier] = f
+            return True
+
+    @classmethod
+    def unregister(cls, game):
+        with cls.lock:
+            if f := cls.running.pop(game.identifier, None):
+                f.close()
+
     def run(self):
         game = self.game
-        command = DOSBOX + game.dosbox_args
-        print('Executing:', ' '.join(command))
-        subprocess.run(command, capture_output=True)
+        try:
+            logger = get_logger(game.identifier)
+
+            # This copies the game's hardlinked files, which takes a
+            # while, so it's done here instead of in the user interface
+            if store := get_store(os.path.dirname(game.path)):
+                try:
+                    store.unshare(game.gamedir)
+                except OSError as e:
+                    logger.error('Could not unshare the game files: %s', e)
+                    record_launch(game=game.identifier, time=time.time(), error=str(e))
+                    return
+
+            command = game.dosbox + game.dosbox_args
+            print('Executing:', ' '.join(command))
+            logger.info('Executing: %s', ' '.join(command))
+            try:
+                process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace')
+            except OSError as e:
+                logger.error('Could not start DOSBox: %s', e)
+                record_launch(game=game.identifier, time=time.time(), error=str(e))
+                return
+            spawned = time.monotonic()
+
+            for line in process.stdout:
+                logger.info(line.rstrip())
+            exit_code = process.wait()
+            duration = time.monotonic() - spawned
+            logger.info('DOSBox exited with code %d after %.1f seconds', exit_code, duration)
+            stats.record_launch(game.identifier, time.time() - duration, duration, exit_code)
+            record_launch(
+                game=game.identifier,
+                time=time.time(),
+                spawn_time=round(spawned - self.requested, 3),
+                duration=round(duration, 1),
+                exit_code=exit_code,
+                autorun=game.autorun,
+            )
+        finally:
+            self.unregister(game)
 
         if not game.autorun:
             if os.path.isfile(game.batfile):
@@ -183,31 +316,122 @@ class DOSBox(Thread):
                         game.write_metadata()
 
 
-class Download(Thread):
-    def __init__(self, urls, gamedir):
+def archive_filename(url):
+    return unquote(url.split('/')[-1]).split('/')[-1]
+
+
+def lock_file(f):
+    '''Try to lock an open file without waiting. Returns False if another process holds the lock.'''
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+class Download:
+    def __init__(self, urls, gamedir, throttle=None, progress=None):
         self.urls = urls
         self.gamedir = gamedir
-        super().__init__(daemon=True)
+        self.staging = gamedir + '.part'
+        self.throttle = throttle
+        self.progress = progress or Progress(os.path.basename(os.path.dirname(gamedir)))
+        self.store = get_store(os.path.dirname(os.path.dirname(gamedir)))
+        self.files = {}
 
     def run(self):
-        for u in self.urls:
-            filename = unquote(u.split('/')[-1]).split('/')[-1]
-            dest = os.path.join(os.path.dirname(self.gamedir), filename)
-            if not os.path.isfile(dest):
-                print(f'Downloading {u}...', end='', flush=True)
-                request.urlretrieve(u, dest)
-                print('done!')
-            if filename.endswith('zip') or filename.endswith('ZIP') or filename.endswith('play'):
+        # Files are extracted to a staging directory that only becomes
+        # the game directory once every archive has been extracted, so
+        # that an interrupted download never looks like a complete game
+        shutil.rmtree(self.staging, ignore_errors=True)
+        try:
+            for i, u in enumerate(self.urls):
+                self.progress.start('download', u, step=i + 1, steps=len(self.urls))
+                self.get(u)
+            os.makedirs(self.staging, exist_ok=True)
+            os.replace(self.staging, self.gamedir)
+            manifest.save(os.path.dirname(self.gamedir), self.files)
+            stats.record_download(os.path.basename(os.path.dirname(self.gamedir)))
+            self.progress.finish()
+        except Exception as e:
+            print(e)
+            self.progress.finish(failed=True)
+
+            # Don't leave a half-extracted game behind
+            shutil.rmtree(self.staging, ignore_errors=True)
+
+    def get(self, url):
+        filename = archive_filename(url)
+        dest = os.path.join(os.path.dirname(self.gamedir), filename)
+        is_archive = filename.endswith('zip') or filename.endswith('ZIP') or filename.endswith('play')
+        if os.path.isfile(dest):
+            if is_archive:
                 print(f'Extracting {filename}...', end='', flush=True)
                 try:
                     self.unzip(dest)
                     print('done!')
                 except:
                     print('failed.')
+        else:
+            print(f'Downloading {url}...', flush=True)
+            fetch = Fetch(url, dest, options.connections, options.retries, options.timeout, self.throttle, self.progress)
+            if is_archive:
+                self.download_and_unzip(fetch)
             else:
-                os.makedirs(self.gamedir, exist_ok=True)
-                shutil.copy(dest, self.gamedir)
+                fetch.run()
+            print(f'Downloaded {filename}')
+
+        if not is_archive:
+            os.makedirs(self.staging, exist_ok=True)
+            shutil.copy(dest, self.staging)
+            self.files.update(manifest.from_file(dest, self.staging))
+        else:
+            self.files.update(manifest.from_zipfile(dest, self.staging))
+            if not options.keep_archives:
+                os.remove(dest)
+
+    def download_and_unzip(self, fetch):
+        '''
+        Extract the archive while it is being downloaded. If that's not
+        possible, extract it afterwards.
+
+        '''
+        fetch.start()
+        try:
+            with PartReader(fetch) as reader:
+                stream_extract(reader, self.staging, self.store)
+            extracted = True
+        except Unsupported as e:
+            print(f'Cannot extract while downloading ({e})')
+            extracted = False
+        except:
+
+            # Don't keep downloading an archive that can't be extracted
+            fetch.cancel()
+            fetch.done.wait()
+            raise
+        fetch.join()
+        fetch.commit()
+        if not extracted:
+            self.unzip(fetch.dest)
 
     def unzip(self, zipfile):
         with ZipFile(zipfile, 'r') as f:
-            f.extractall(self.gamedir)
+            members = f.infolist()
+            self.progress.start('extract', total=sum(info.file_size for info in members))
+            for info in members:
+                if self.store and not info.is_dir():
+
+                    # Files that are already linked to the store may be read-only
+                    dest = safe_path(self.staging, info.filename)
+                    if os.path.isfile(dest):
+                        os.remove(dest)
+                    self.store.add(f.extract(info, self.staging), info.CRC, info.file_size)
+                else:
+                    f.extract(info, self.staging)
+                self.progress.advance(info.file_size)
@@ -0,0 +1,212 @@
+'''
+Keeps the downloaded games within a disk quota, and downloads small
+games around the current one before the user asks for them.
+
+While browsing, the games next to the current one are likely picks.
+Those whose archives are smaller than options.speculative_size are
+queued with BACKGROUND priority, so that they are often ready by the
+time the user presses Enter. Speculative downloads that haven't
+started yet are cancelled when the user moves on. This only happens
+when there is a disk quota, so that browsing never fills the disk.
+
+When the games take more space than options.disk_quota, the games
+that were played least recently are deleted (extracted files and
+archives), until the total fits again. Games with save data, that is,
+files the game changed or created since it was extracted, are never
+deleted unless options.evict_saves is set. Neither are games that are
+running, downloading or next to the current one.
+
+'''
+import os
+import time
+from threading import Thread, Condition
+
+from .game import DOSBox
+from .fetch import Fetch
+from .stats import stats
+from .scheduler import scheduler, BACKGROUND
+from . import manifest
+from . import options
+
+CHECK_INTERVAL = 60  # seconds
+
+# Files that are written by Game.start(), not by the game
+GENERATED = {'dosbox.bat', 'dosbox.conf'}
+
+
+def disk_usage(path):
+    '''
+    Return the number of bytes used by the files under path. Files that
+    are hardlinked (see store.py) only count for their share.
+
+    '''
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            total += st.st_size // max(st.st_nlink, 1)
+    return total
+
+
+def has_saves(game):
+    '''
+    Return True if the game changed or created any files since it was
+    extracted. A file counts as changed if its size differs from the
+    manifest or if it was modified after the manifest was written, so
+    that saves of a fixed size are noticed as well. Games without a
+    manifest are assumed to have saves.
+
+    '''
+    files = manifest.load(game.path)
+    if files is None:
+        return True
+    try:
+        extracted = os.stat(os.path.join(game.path, manifest.FILENAME)).st_mtime_ns
+    except OSError:
+        return True
+    missing, changed = manifest.check(game.gamedir, files, since=extracted)
+    if any(name not in GENERATED for name in changed):
+        return True
+    for root, dirs, names in os.walk(game.gamedir):
+        for name in names:
+            relative = os.path.relpath(os.path.join(root, name), game.gamedir).replace(os.sep, '/')
+            if relative not in files and relative not in GENERATED:
+                return True
+    return False
+
+
+class GameCache:
+    def __init__(self, games):
+        self.games = games
+        self.wanted = []
+        self.protected = set()
+        self.speculative = {}
+        self.sizes = {}
+        self.usage = {}
+        self.changed = False
+        self.condition = Condition()
+        Thread(target=self.run, daemon=True).start()
+
+    def speculate(self, games):
+        '''
+        Download the given games in the background if they are small,
+        in order, and protect them from eviction. Replaces the games
+        that were given before.
+
+        '''
+        games = list(games)
+        with self.condition:
+            if [game.identifier for game in games] != [game.identifier for game in self.wanted]:
+                self.wanted = games
+                self.changed = True
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.changed:
+                    self.condition.wait(CHECK_INTERVAL)
+                self.changed = False
+                wanted = self.wanted
+            try:
+                self.protected = {game.identifier for game in wanted}
+                if options.disk_quota:
+                    self.evict()
+                    if options.speculative_size:
+                        self.fetch(wanted)
+            except Exception as e:
+                print('Error managing the game cache:', e)
+
+    def download_size(self, game):
+        '''Return the number of bytes that downloading the game takes, or None if unknown'''
+        if game.identifier not in self.sizes:
+            total = 0
+            for url, path in zip(game.urls, game.archives()):
+                if os.path.isfile(path):
+                    total += os.path.getsize(path)
+                    continue
+                fetch = Fetch(url, path, retries=1, timeout=options.timeout)
+                try:
+                    fetch.probe()
+                except Exception:
+                    total = None
+                    break
+                if fetch.size is None:
+                    total = None
+                    break
+                total += fetch.size
+            self.sizes[game.identifier] = total
+        return self.sizes[game.identifier]
+
+    def fetch(self, wanted):
+        identifiers = {game.identifier for game in wanted}
+        for identifier in list(self.speculative):
+            if identifier not in identifiers:
+                scheduler.cancel(self.speculative.pop(identifier))
+
+        used = self.used()
+        for game in wanted:
+            if self.changed:
+                return
+            if game.is_ready() or game.download_in_progress() or not game.configured:
+                continue
+            size = self.download_size(game)
+            if size is None or size > options.speculative_size * 1000000:
+                continue
+            if used + size > options.disk_quota * 1000000:
+                continue
+            used += size
+            self.speculative[game.identifier] = game
+            game.download(BACKGROUND)
+
+    def used(self):
+        '''Return the disk usage of the games, as of the last check'''
+        return sum(size for size, measured in self.usage.values())
+
+    def measure(self, game, last_played):
+        '''Return the disk usage of a downloaded game, measuring it again after it was played'''
+        size, measured = self.usage.get(game.identifier, (None, 0))
+        if size is None or last_played.get(game.identifier, 0) > measured:
+            size = disk_usage(game.gamedir)
+            size += sum(os.path.getsize(path) for path in game.archives() if os.path.isfile(path))
+            self.usage[game.identifier] = size, time.time()
+        return size
+
+    def evict(self):
+        last_played = stats.last_played()
+        downloaded = [
+            game for identifier in self.games.identifiers
+            if os.path.isdir(os.path.join(self.games.games_dir, identifier, 'dosbox_drive_c'))
+            and (game := self.games.find_game(identifier)) and not game.download_in_progress()
+        ]
+        identifiers = {game.identifier for game in downloaded}
+        for identifier in list(self.usage):
+            if identifier not in identifiers:
+                del self.usage[identifier]
+        total = sum(self.measure(game, last_played) for game in downloaded)
+        quota = options.disk_quota * 1000000
+        if total <= quota:
+            return
+
+        # Games that were never played go first, oldest downloads first
+        downloaded.sort(key=lambda game: (last_played.get(game.identifier, 0), os.path.getmtime(game.gamedir)))
+        for game in downloaded:
+            if total <= quota:
+                break
+            if (
+                game.identifier in self.protected
+                or game.identifier in DOSBox.running
+                or (not options.evict_saves and has_saves(game))
+            ):
+                continue
+            print(f'Deleting {game.identifier} to stay within the disk quota')
+            game.reset()
+            for path in game.archives():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= self.usage.pop(game.identifier)[0]
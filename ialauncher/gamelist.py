@@ -1,63 +1,281 @@
-import os
+import os, sys
+import time
+import heapq
 import random
-import pygame as pg
+from bisect import bisect_left
+from threading import Lock
+from weakref import WeakValueDictionary
 
 from .game import Game
+from .imagecache import ImageCache
+from .search import SearchIndex
+from .scheduler import NORMAL
+from .stats import stats
+from . import options
+
+TYPE_AHEAD_TIMEOUT = 1
+
+
+def sort_key(identifier):
+    key = identifier.lower()
+    return identifier if key == identifier else sys.intern(key)
+
 
 class GameList:
-    games = []
-    current_game = 0
+    '''
+    The sorted list of all games in a games directory. To keep memory
+    usage low with very large collections, only the identifier, sort
+    key, title and year of each game are kept, in parallel lists with
+    interned strings. Game objects are created when they are needed,
+    and shared for as long as anyone uses them (for example while the
+    game is being downloaded); their remaining metadata is read from
+    metadata.ini by Game.configure().
+
+    '''
 
-    def add(self, game_dir):
-        try:
-            self.games.append(Game(game_dir))
-        except:
-            print('Error loading', os.path.basename(game_dir))
+    def __init__(self, games_dir, titlepack=None):
+        self.games_dir = games_dir
+        self.identifiers = []
+        self.keys = []
+        self.titles = []
+        self.years = []
+        self.instances = WeakValueDictionary()
+        self.current_game = 0
+        self.typed = ''
+        self.typed_at = 0
+        self.images = ImageCache(options.image_cache_size * 1000000, titlepack)
+        self.index = SearchIndex()
+        self.changes = []
+        self.lock = Lock()
+        self.slides = []
+
+    def __len__(self):
+        return len(self.identifiers)
+
+    def add(self, identifier, title, year):
+        self.identifiers.append(sys.intern(identifier))
+        self.keys.append(sort_key(identifier))
+        self.titles.append(title)
+        self.years.append(sys.intern(year) if year else year)
 
     def sort(self, slideshow):
-        self.games.sort()
+        self.set_rows(sorted(zip(self.keys, self.identifiers, self.titles, self.years)))
         if slideshow:
-            self.current_game = random.randrange(len(self.games))
+            self.current_game = random.randrange(len(self))
+
+    def set_rows(self, rows):
+        '''Replace the games with the given (key, identifier, title, year) rows'''
+        columns = list(zip(*rows)) or [(), (), (), ()]
+        self.keys, self.identifiers, self.titles, self.years = map(list, columns)
+
+    def game(self, i):
+        '''Return the Game at index i'''
+        identifier = self.identifiers[i]
+        with self.lock:
+            game = self.instances.get(identifier)
+            if game is None:
+                game = self.instances[identifier] = Game(os.path.join(self.games_dir, identifier))
+        return game
+
+    def find_game(self, identifier):
+        '''Return the Game with the given identifier, or None'''
+        if (i := self.index_of(identifier)) is not None:
+            return self.game(i)
+
+    def all_games(self):
+        for i in range(len(self)):
+            yield self.game(i)
+
+    def change(self, changed, removed=()):
+        '''
+        Queue the games that were added or changed, as a dict of
+        identifier -> metadata, and the identifiers of games that were
+        removed. Can be called from any thread; the changes are applied
+        by apply_changes().
+
+        '''
+        with self.lock:
+            self.changes.append((changed, removed))
+
+    def apply_changes(self):
+        '''
+        Apply the queued changes, keeping the list sorted and the current
+        game selected (or its nearest neighbour, if it was removed).
+        Returns the identifiers of the games that changed.
+
+        '''
+        with self.lock:
+            changes, self.changes = self.changes, []
+        added = {}
+        removed = set()
+        for games, gone in changes:
+            for identifier, metadata in games.items():
+                added[identifier] = metadata['title'], metadata['year']
+                removed.discard(identifier)
+            for identifier in gone:
+                added.pop(identifier, None)
+                removed.add(identifier)
+        changed = set(added) | removed
+        if not changed:
+            return changed
+
+        current = self.identifiers[self.current_game]
+        rows = (row for row in zip(self.keys, self.identifiers, self.titles, self.years) if row[1] not in changed)
+        new = sorted((sort_key(identifier), sys.intern(identifier), title, year) for identifier, (title, year) in added.items())
+        rows = list(heapq.merge(rows, new))
+        if not rows:
+            return set()
+        self.set_rows(rows)
+        self.current_game = min(bisect_left(self.keys, current.lower()), len(self) - 1)
+        if current not in removed:
+            self.select(current)
+
+        for identifier in changed:
+            self.instances.pop(identifier, None)
+            self.images.invalidate(identifier)
+        self.index.ready.wait()
+        self.index.update([(identifier, title, year) for identifier, (title, year) in added.items()], removed)
+        return changed
 
     def get_image(self):
         game = self.get_current_game()
-        if not hasattr(game, 'cached_image'):
-            game.cached_image = pg.image.load(game.get_titlescreen())
-        return game.cached_image
+        image = self.images.load(game.identifier, game.get_titlescreen())
+        self.prefetch()
+        return image
+
+    def nearby(self, n):
+        '''Return the current game and the n games on either side, nearest first'''
+        indexes = [self.current_game]
+        for i in range(1, n + 1):
+            indexes.append((self.current_game + i) % len(self))
+            indexes.append((self.current_game - i) % len(self))
+        return [self.game(i) for i in indexes]
+
+    def neighbours(self):
+        '''Return the surrounding games and the first game of the next letter'''
+        return self.nearby(options.prefetch)[1:] + [self.game(self.next_letter_index())]
+
+    def prefetch(self):
+        '''Decode the title screens of the neighbouring games in the background'''
+        self.images.prefetch((game.identifier, game.get_titlescreen()) for game in self.neighbours())
+
+    def most_popular(self, n):
+        '''Return the n games that are played the most (see stats.py)'''
+        scores = stats.popularity()
+        popular = sorted(scores, key=scores.get, reverse=True)
+        return [game for identifier in popular if (game := self.find_game(identifier))][:n]
+
+    def prewarm(self, n):
+        '''
+        Make sure the n most popular games are downloaded, and decode
+        their title screens, so that they are ready when asked for
+
+        '''
+        for game in self.most_popular(n):
+            if not game.is_ready():
+                game.download(NORMAL)
+            self.images.load(game.identifier, game.get_titlescreen())
+
+    def build_index(self):
+        '''Start building the search index in the background'''
+        self.index.start(list(zip(self.identifiers, self.titles, self.years)))
+
+    def search(self, query):
+        '''Return the identifiers of the games that best match the query'''
+        self.index.ready.wait()
+        return self.index.search(query)
+
+    def index_of(self, identifier):
+        '''Return the index of the game with the given identifier, or None'''
+        i = bisect_left(self.keys, identifier.lower())
+        while i < len(self) and self.keys[i] == identifier.lower():
+            if self.identifiers[i] == identifier:
+                return i
+            i += 1
+
+    def select(self, identifier):
+        '''Jump to the game with the given identifier'''
+        if (i := self.index_of(identifier)) is not None:
+            self.current_game = i
+
+    def upcoming_slide(self):
+        '''
+        Return the game that the slideshow shows next. The slideshow goes
+        through all games in a random order before it repeats any.
+
+        '''
+        while True:
+            if not self.slides:
+                self.slides = list(self.identifiers)
+                random.shuffle(self.slides)
+
+                # Don't show the current game again right away
+                if self.slides[-1] == self.identifiers[self.current_game]:
+                    self.slides[0], self.slides[-1] = self.slides[-1], self.slides[0]
+            if (i := self.index_of(self.slides[-1])) is not None:
+                return self.game(i)
+
+            # The game was removed in the meantime
+            self.slides.pop()
+
+    def next_slide(self):
+        self.select(self.upcoming_slide().identifier)
+        self.slides.pop()
 
     def get_current_game(self):
-        return self.games[self.current_game]
+        return self.game(self.current_game)
+
+    def find(self, prefix):
+        '''Return the index of the first game that starts with prefix, or None'''
+        prefix = prefix.lower()
+        i = bisect_left(self.keys, prefix)
+        if i < len(self.keys) and self.keys[i].startswith(prefix):
+            return i
+
+    def next_letter_index(self):
+        '''Return the index of the next game with different letter'''
+        letter = self.keys[self.current_game][0]
+        index = bisect_left(self.keys, chr(ord(letter) + 1))
+        if index >= len(self):
+            index = 0
+        return index
 
     def next_letter(self):
         '''Jump to the next game with different letter'''
-        letter = self.get_current_game().identifier.lower()[0]
-        for game in self.games[self.current_game:]:
-            if not game.identifier.lower().startswith(letter):
-                break
-            self.current_game += 1
-        if self.current_game >= len(self.games):
-            self.current_game = 0
+        self.current_game = self.next_letter_index()
 
     def previous_letter(self):
         '''Jump to the first game that starts with previous game's letter'''
-        letter = self.games[(self.current_game - 1) % len(self.games)].identifier.lower()[0]
-        for i, game in enumerate(self.games):
-            if game.identifier.lower().startswith(letter):
-                self.current_game = i
-                break
+        letter = self.keys[(self.current_game - 1) % len(self)][0]
+        self.current_game = bisect_left(self.keys, letter)
 
     def next_game(self):
-        self.current_game = (self.current_game + 1) % len(self.games)
+        self.current_game = (self.current_game + 1) % len(self)
 
     def previous_game(self):
-        self.current_game = (self.current_game - 1) % len(self.games)
+        self.current_game = (self.current_game - 1) % len(self)
 
     def random_game(self):
-        self.current_game = random.randrange(len(self.games))
+        self.current_game = random.randrange(len(self))
 
     def letter(self, letter):
-        '''Jump to specific letter'''
-        for i, game in enumerate(self.games):
-            if game.identifier.lower().startswith(letter):
-                self.current_game = i
-                break
+        '''Jump to specific letter (or prefix)'''
+        index = self.find(letter)
+        if index is not None:
+            self.current_game = index
+
+    def typing(self):
+        '''Return True if the user is in the middle of typing a prefix'''
+        return self.typed and time.monotonic() - self.typed_at < TYPE_AHEAD_TIMEOUT
+
+    def type_ahead(self, char):
+        '''
+        Jump to the first game that starts with the characters that
+        were typed in quick succession
+
+        '''
+        if not self.typing():
+            self.typed = ''
+        self.typed += char
+        self.typed_at = time.monotonic()
+        self.letter(self.typed)
@@ -0,0 +1,121 @@
+'''
+A byte-bounded LRU cache for title screens, with a background thread
+that decodes images before they are needed.
+
+'''
+from collections import OrderedDict
+from threading import Lock
+import pygame as pg
+
+from .profiling import timed
+from .worker import Worker
+
+
+def surface_size(surface):
+    '''Return the number of bytes used by a surface's pixels'''
+    return surface.get_pitch() * surface.get_height()
+
+
+class LRUCache:
+    '''
+    Thread-safe cache of surfaces that holds at most `max_bytes` worth
+    of pixels. The least recently used surfaces are dropped first,
+    except those with a key that was pinned.
+
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items = OrderedDict()
+        self.pinned = set()
+        self.lock = Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.items
+
+    def get(self, key):
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                return self.items[key]
+
+    def put(self, key, surface):
+        with self.lock:
+            if key in self.items:
+                self.size -= surface_size(self.items.pop(key))
+            self.items[key] = surface
+            self.size += surface_size(surface)
+
+            # Always keep the newest item, even if it's too big
+            while self.size > self.max_bytes:
+                old = next((k for k in self.items if k != key and k not in self.pinned), None)
+                if old is None:
+                    break
+                self.size -= surface_size(self.items.pop(old))
+
+    def pin(self, keys):
+        '''Keep the items with the given keys, replacing the keys that were pinned before'''
+        with self.lock:
+            self.pinned = set(keys)
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.items:
+                self.size -= surface_size(self.items.pop(key))
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+
+class ImageCache(LRUCache):
+    '''
+    LRU cache of decoded title screens. Call prefetch() with the
+    images that are likely to be needed next, and they will be
+    decoded by a background thread. Images that are available in
+    the given title pack are read from there instead.
+
+    '''
+
+    def __init__(self, max_bytes, titlepack=None):
+        super().__init__(max_bytes)
+        self.titlepack = titlepack
+        self.changed = set()
+        self.worker = Worker(self.decode_pending)
+
+    def load(self, key, path):
+        '''Return the image at `path`, decoding it if necessary'''
+        image = self.get(key)
+        if image is None:
+            image = self.decode(key, path)
+            self.put(key, image)
+        return image
+
+    def invalidate(self, key):
+        '''Forget an image that changed on disk, including its copy in the title pack'''
+        self.changed.add(key)
+        self.discard(key)
+
+    def decode(self, key, path):
+        with timed('decode'):
+            if self.titlepack and key not in self.changed and (image := self.titlepack.get(key, path)):
+                return image
+            if path is None:
+                return pg.Surface((320, 200))
+            return pg.image.load(path)
+
+    def prefetch(self, images):
+        '''
+        Decode the given (key, path) pairs in the background, in order.
+        Replaces any previous prefetch requests that weren't handled yet.
+
+        '''
+        self.worker.submit(images)
+
+    def decode_pending(self, image):
+        key, path = image
+        if key not in self:
+            self.put(key, self.decode(key, path))
@@ -0,0 +1,51 @@
+'''
+Log files for DOSBox sessions. The output of each game goes to its own
+rotating log file, and a summary of every launch (how long DOSBox took
+to start, how long the session lasted and how it ended) is appended
+to launches.jsonl, to find slow launches and crashing games.
+
+'''
+import os
+import json
+import logging
+from logging.handlers import RotatingFileHandler
+from threading import Lock
+
+from . import options
+
+BACKUP_COUNT = 2
+LAUNCHES = 'launches.jsonl'
+lock = Lock()
+
+
+def get_logger(identifier):
+    '''Return the logger that writes to the log file of a game'''
+    logger = logging.getLogger(f'ialauncher.dosbox.{identifier}')
+    if not logger.handlers:
+        try:
+            os.makedirs(options.log_dir, exist_ok=True)
+            handler = RotatingFileHandler(
+                os.path.join(options.log_dir, f'{identifier}.log'),
+                maxBytes=options.log_size * 1000,
+                backupCount=BACKUP_COUNT,
+                encoding='utf-8',
+            )
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        except OSError as e:
+            print(f'Cannot write the log file of {identifier}: {e}')
+            handler = logging.NullHandler()
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+def record_launch(**launch):
+    '''Append a summary of a launch to launches.jsonl'''
+    with lock:
+        try:
+            os.makedirs(options.log_dir, exist_ok=True)
+            with open(os.path.join(options.log_dir, LAUNCHES), 'a') as f:
+                f.write(json.dumps(launch) + '\n')
+        except OSError:
+            pass
@@ -0,0 +1,89 @@
+'''
+The manifest of a game lists the files that were extracted from its
+archives, with their sizes and CRC-32s. It is saved next to the
+game's metadata.ini, so that `ialauncher verify` can check whether a
+game is complete, even when the archives were deleted.
+
+'''
+import os
+import json
+import zlib
+from zipfile import ZipFile
+
+from .unzip import safe_path
+
+FILENAME = 'manifest.json'
+CHUNK_SIZE = 1024 * 1024
+
+
+def crc32(path):
+    checksum = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            checksum = zlib.crc32(chunk, checksum)
+    return checksum
+
+
+def relative_path(gamedir, name):
+    return os.path.relpath(safe_path(gamedir, name), gamedir).replace(os.sep, '/')
+
+
+def from_zipfile(path, gamedir):
+    '''Return the manifest entries of the files in a zip file'''
+    with ZipFile(path, 'r') as f:
+        return {
+            relative_path(gamedir, info.filename): [info.file_size, info.CRC]
+            for info in f.infolist() if not info.is_dir()
+        }
+
+
+def from_file(path, gamedir):
+    '''Return the manifest entry of a file that was copied as-is'''
+    return {relative_path(gamedir, os.path.basename(path)): [os.path.getsize(path), crc32(path)]}
+
+
+def load(path):
+    '''Return the manifest of the game at path, or None if it has none'''
+    try:
+        with open(os.path.join(path, FILENAME), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save(path, files):
+    with open(os.path.join(path, FILENAME), 'w') as f:
+        json.dump(files, f, separators=(',', ':'))
+
+
+def remove(path):
+    try:
+        os.remove(os.path.join(path, FILENAME))
+    except FileNotFoundError:
+        pass
+
+
+def check(gamedir, files, thorough=False, since=None):
+    '''
+    Compare the files in gamedir with the manifest. Returns the files
+    that are missing and the files that were changed (for example by
+    the game itself). Only sizes are compared, unless thorough is set.
+    If since is given, files modified after that time (in nanoseconds)
+    count as changed as well.
+
+    '''
+    missing = []
+    changed = []
+    for name, (size, crc) in files.items():
+        path = os.path.join(gamedir, *name.split('/'))
+        try:
+            st = os.stat(path)
+            if (
+                st.st_size != size
+                or (since is not None and st.st_mtime_ns > since)
+                or (thorough and crc32(path) != crc)
+            ):
+                changed.append(name)
+        except OSError:
+            missing.append(name)
+    return missing, changed
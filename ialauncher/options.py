@@ -3,5 +3,39 @@ Default options for IA Launcher. Can be overridden with
 command-line arguments.
 
 '''
+import os
+
 fullscreen = True
-slideshow = 0
+slideshow = 0  # seconds per title screen, 0 = no slideshow
+crossfade = 0  # seconds, 0 = switch title screens at once
+image_cache_size = 64  # megabytes
+prefetch = 5
+prewarm = 10  # most popular games
+scale = 'stretch'
+scaled_cache_size = 128  # megabytes
+smooth = False
+aspect_correction = False
+thumbnail_width = 160  # pixels, in the wall view
+thumbnail_cache_size = 64  # megabytes
+thumbnail_workers = 2
+connections = 4
+retries = 5
+timeout = 30  # seconds
+download_workers = 2
+bandwidth_limit = 0  # kilobytes per second, 0 = unlimited
+keep_archives = True
+disk_quota = 0  # megabytes, 0 = unlimited
+speculative_size = 20  # megabytes, 0 = don't download games speculatively
+speculate = 2  # games on either side of the current one
+evict_saves = False
+dedup = False
+dedup_min_size = 4096  # bytes
+watch = True  # update the game list when the games directory changes
+watch_interval = 10  # seconds, when inotify isn't available
+timings = False
+profile = False
+dosbox = None  # command, found automatically if not set
+cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'ialauncher')
+log_dir = os.path.join(cache_dir, 'logs')
+data_dir = os.path.join(os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share'), 'ialauncher')
+log_size = 1000  # kilobytes per log file
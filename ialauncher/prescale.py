@@ -0,0 +1,81 @@
+'''
+Scale title screens to the display resolution before they are needed.
+
+Scaling a title screen takes a few milliseconds, or more with
+smoothing, and it used to happen exactly when the user pressed a key.
+Now a background thread scales the title screens of the neighbouring
+games into the cache of scaled images, so that Browse usually only
+has to blit a surface that is ready.
+
+'''
+import pygame as pg
+
+from .worker import Worker
+from . import options
+
+# Title screens were made for 4:3 monitors, whatever their resolution
+DISPLAY_ASPECT = 4 / 3
+
+
+def target_size(size, screen_size):
+    '''
+    Return the size of an image scaled to the screen size. Depending on
+    options.scale, the image is either stretched, scaled while keeping
+    its aspect ratio (optionally corrected to 4:3), or scaled by the
+    largest integer factor that fits.
+
+    '''
+    width, height = screen_size
+    w, h = size
+    if options.scale == 'integer' and (factor := min(width // w, height // h)):
+        return w * factor, h * factor
+    if options.scale == 'stretch':
+        return screen_size
+    if options.aspect_correction:
+        w = h * DISPLAY_ASPECT
+    factor = min(width / w, height / h)
+    return round(w * factor), round(h * factor)
+
+
+def scale(image, screen_size):
+    '''Scale an image to the screen size, smoothing it if enabled'''
+    size = target_size(image.get_size(), screen_size)
+    if options.smooth and options.scale != 'integer':
+        if image.get_bitsize() < 24:
+            rgb = pg.Surface(image.get_size(), depth=24)
+            rgb.blit(image, (0,0))
+            image = rgb
+        return pg.transform.smoothscale(image, size)
+    return pg.transform.scale(image, size)
+
+
+class Prescaler:
+    '''
+    Scales title screens into `scaled_images` in the background. The
+    source images are taken from (or decoded into) `images`.
+
+    '''
+
+    def __init__(self, images, scaled_images):
+        self.images = images
+        self.scaled_images = scaled_images
+        self.worker = Worker(self.scale_pending)
+
+    def prefetch(self, games, screen_size):
+        '''
+        Scale the title screens of the given games in the background, in
+        order. Replaces any previous requests that weren't handled yet.
+        Only as many games as fit in the cache next to the current one
+        are scaled, so that they don't push each other out.
+
+        '''
+        width, height = screen_size
+        games = games[:max(0, self.scaled_images.max_bytes // (width * height * 4) - 1)]
+        self.worker.submit((game.identifier, game.get_titlescreen(), screen_size) for game in games)
+
+    def scale_pending(self, request):
+        identifier, path, screen_size = request
+        key = identifier, screen_size
+        if key not in self.scaled_images:
+            image = self.images.load(identifier, path)
+            self.scaled_images.put(key, scale(image, screen_size).convert())
@@ -0,0 +1,123 @@
+'''
+Optional instrumentation to find out where the time goes.
+
+With --timings, the engine records how long each frame takes to
+handle events, update and flip, and other modules record the time
+spent decoding and scaling images and handling downloaded data. A
+histogram of frame times shows stutters. Press F12 to show the
+numbers on screen; they are also printed on exit.
+
+With --profile, each scene additionally runs under cProfile, and the
+busiest functions of each scene are printed on exit.
+
+'''
+import os
+import time
+import bisect
+import pstats
+import cProfile
+from threading import Lock
+
+from . import options
+
+# Upper bounds of the frame time histogram buckets, in milliseconds
+BUCKETS = [2, 4, 8, 16, 33, 50, 100, 250, 1000]
+PROFILE_LINES = 20
+
+
+class Timer:
+    def __init__(self, timings, phase):
+        self.timings = timings
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        self.timings.add(self.phase, time.perf_counter() - self.start)
+
+
+class NullTimer:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+class Timings:
+    def __init__(self):
+        self.lock = Lock()
+        self.overlay = False
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.totals = {}
+            self.counts = {}
+            self.maxima = {}
+            self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def add(self, phase, duration):
+        with self.lock:
+            self.totals[phase] = self.totals.get(phase, 0) + duration
+            self.counts[phase] = self.counts.get(phase, 0) + 1
+            self.maxima[phase] = max(self.maxima.get(phase, 0), duration)
+
+    def frame(self, duration):
+        '''Record the time it took to produce a frame'''
+        self.add('frame', duration)
+        with self.lock:
+            self.histogram[bisect.bisect_left(BUCKETS, duration * 1000)] += 1
+
+    def report(self):
+        with self.lock:
+            lines = [f'{"phase":<10} {"count":>7} {"mean ms":>8} {"max ms":>8} {"total s":>8}']
+            for phase in sorted(self.totals):
+                count, total = self.counts[phase], self.totals[phase]
+                lines.append(f'{phase:<10} {count:>7} {1000 * total / count:>8.2f} {1000 * self.maxima[phase]:>8.1f} {total:>8.2f}')
+            lines.append('')
+            lines.append('frame time histogram:')
+            lower = 0
+            for upper, count in zip(BUCKETS + [None], self.histogram):
+                label = f'{lower}-{upper} ms' if upper else f'>{lower} ms'
+                lines.append(f'{label:>12} {count:>7}')
+                lower = upper
+        return '\n'.join(lines)
+
+
+timings = Timings()
+null_timer = NullTimer()
+profilers = {}
+
+
+def timed(phase):
+    '''Return a context manager that records the time spent in phase, if enabled'''
+    if options.timings:
+        return Timer(timings, phase)
+    return null_timer
+
+
+def run_scene(scene, screen):
+    '''Run a scene, under cProfile if profiling is enabled'''
+    if not options.profile:
+        return scene.run(screen)
+    name = type(scene).__name__
+    profiler = profilers.setdefault(name, cProfile.Profile())
+    return profiler.runcall(scene.run, screen)
+
+
+def dump():
+    '''Print the timings and profiles that were recorded'''
+    if options.timings:
+        print(timings.report())
+    for name, profiler in profilers.items():
+        print(f'\nProfile of the {name} scene:')
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        try:
+            os.makedirs(options.cache_dir, exist_ok=True)
+            path = os.path.join(options.cache_dir, f'profile-{name}.prof')
+            profiler.dump_stats(path)
+            print('Saved profile to', path)
+        except OSError:
+            pass
@@ -0,0 +1,94 @@
+'''
+Thread-safe progress reporting for downloads. The download thread
+updates a Progress object, and the UI (or the slurp mode reporter)
+reads it whenever it wants to show something.
+
+'''
+import time
+from threading import Lock
+
+RATE_INTERVAL = 0.5
+RATE_SMOOTHING = 0.3
+
+PHASES = {
+    'queued': 'Waiting to download',
+    'download': 'Downloading',
+    'extract': 'Extracting',
+    'done': 'Done',
+    'failed': 'Failed',
+}
+
+
+def megabytes(nbytes):
+    return f'{nbytes / 1000000:.1f} MB'
+
+
+class Progress:
+    def __init__(self, name):
+        self.name = name
+        self.lock = Lock()
+        self.phase = 'queued'
+        self.url = None
+        self.step = 0
+        self.steps = 0
+        self.done = 0
+        self.total = None
+        self.rate = 0
+        self.sample_time = 0
+        self.sample_done = 0
+
+    def start(self, phase, url=None, total=None, done=0, step=None, steps=None):
+        '''Start a new phase, optionally for the given step (URL) of a download'''
+        with self.lock:
+            self.phase = phase
+            self.url = url or self.url
+            self.step = step or self.step
+            self.steps = steps or self.steps
+            self.total = total
+            self.done = done
+            self.rate = 0
+            self.sample_time = time.monotonic()
+            self.sample_done = done
+
+    def update(self, done):
+        '''Set the number of bytes done, and update the throughput'''
+        with self.lock:
+            self.done = done
+            now = time.monotonic()
+            elapsed = now - self.sample_time
+            if elapsed >= RATE_INTERVAL:
+                rate = max(done - self.sample_done, 0) / elapsed
+                self.rate = rate if not self.rate else RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * self.rate
+                self.sample_time = now
+                self.sample_done = done
+
+    def advance(self, nbytes):
+        self.update(self.done + nbytes)
+
+    def finish(self, failed=False):
+        with self.lock:
+            self.phase = 'failed' if failed else 'done'
+
+    def eta(self):
+        '''Return the estimated number of seconds left, or None if unknown'''
+        with self.lock:
+            if self.total and self.rate:
+                return max(self.total - self.done, 0) / self.rate
+
+    def __str__(self):
+        with self.lock:
+            if self.phase not in ('download', 'extract'):
+                return f'{PHASES[self.phase]}: {self.name}'
+            text = PHASES[self.phase]
+            if self.steps > 1:
+                text += f' ({self.step}/{self.steps})'
+            text += f' {self.url or self.name}'
+            text += f'\n{megabytes(self.done)}'
+            if self.total:
+                text += f' of {megabytes(self.total)} ({100 * self.done // self.total}%)'
+            if self.rate:
+                text += f', {megabytes(self.rate)}/s'
+        eta = self.eta()
+        if eta is not None:
+            text += f', {int(eta) // 60}:{int(eta) % 60:02} left'
+        return text
@@ -1,59 +1,109 @@
 import os
+import time
 import random
 import pygame as pg
 import games as gd
 
 from .gamelist import GameList
+from .catalog import Catalog
+from .imagecache import LRUCache
+from .titlepack import TitlePack
+from .prescale import Prescaler, scale
+from .thumbnails import Thumbnails
+from .text import get_font
+from .gamecache import GameCache
+from .watcher import Watcher
+from .scheduler import scheduler, BACKGROUND
+from .dosbox import DOSBoxNotFound
 from .engine import Scene
+from .profiling import timed
 from . import options
 
 ADVANCE = pg.event.custom_type()
+GAMES_CHANGED = pg.event.custom_type()
+THUMBNAILS_READY = pg.event.custom_type()
+
+
+def describe(title, year):
+    '''Return the title of a game, followed by its year if it has one'''
+    return f'{title} ({year})' if year else title
 
 
 class Loading(Scene):
     counter = 0
 
-    def __init__(self, slurp_mode=False):
+    def __init__(self, slurp_mode=False, rescan=False, games_dir=None):
         self.slurp_mode = slurp_mode
-        self.games_dir = os.path.dirname(gd.__file__)
-        self.todo = [
-            os.path.join(self.games_dir, entry) for entry in os.listdir(self.games_dir)
-            if os.path.exists(os.path.join(self.games_dir, entry, 'metadata.ini'))
-        ]
-        self.games = GameList()
-        super().__init__()
+        self.games_dir = games_dir or os.path.dirname(gd.__file__)
+        self.catalog = Catalog(self.games_dir)
+        if self.catalog.load() and not rescan:
+            self.outdated = []
+        else:
+            self.outdated = self.catalog.scan()
+            if not self.outdated:
 
-    def get_events(self):
-        return pg.event.get()
+                # Only the games directory itself changed, for example
+                # because a game was removed
+                self.catalog.save()
+        self.games = GameList(self.games_dir, TitlePack.open(self.games_dir))
+        super().__init__()
 
     def handle(self, event):
         if event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE:
             return self.done()
 
-    def load_games(self, number_of_games):
-        while self.todo and number_of_games:
-            path = self.todo.pop()
-            self.games.add(path)
+    def scan_catalog(self, number_of_games):
+        while self.outdated and number_of_games:
+            self.catalog.read(self.outdated.pop())
             self.counter += 1
             number_of_games -= 1
+        if not self.outdated:
+            self.catalog.save()
+
+    def load_games(self):
+        for identifier, entry in self.catalog.entries.items():
+            self.games.add(identifier, *entry[1:3])
+        self.games.build_index()
 
-    def download_game(self):
-        path = self.todo.pop()
-        self.games.add(path)
-        Download(self.games.games[-1]).run(self.screen)
-        self.counter += 1
+    def queue_downloads(self):
+
+        # Not in the games directory, where every save would make the catalog outdated
+        scheduler.start(os.path.join(options.data_dir, 'downloads.json'))
+        scheduler.restore(self.games.find_game)
+        self.games.prewarm(options.prewarm)
+        if self.slurp_mode:
+            scheduler.submit_many(
+                (game for game in self.games.all_games() if not os.path.isdir(game.gamedir)),
+                BACKGROUND,
+            )
+            scheduler.start_reporting()
 
     def done(self):
+        if not len(self.games):
+            self.load_games()
+
+        # The game list keeps what it needs, the rest is read when needed
+        mtimes = {identifier: entry[0] for identifier, entry in self.catalog.entries.items()}
+        self.catalog = None
         self.games.sort(slideshow=options.slideshow)
+        self.queue_downloads()
+        if options.watch:
+            Watcher(self.games_dir, self.games_changed, mtimes).start()
         return Browse(self.games)
 
+    def games_changed(self, changed, removed):
+        '''Called by the watcher (in its own thread)'''
+        self.games.change(changed, removed)
+        pg.event.post(pg.event.Event(GAMES_CHANGED))
+
     def update(self, screen):
-        if not self.todo:
-            return self.done()
-        if self.slurp_mode:
-            self.download_game()
+        if self.outdated:
+            self.scan_catalog(100)
+        elif not len(self.games):
+            self.load_games()
         else:
-            self.load_games(10)
+            return self.done()
+        self.invalidate()
         screen.fill((0,0,0))
         self.draw(screen, f'''
 Welcome to IA Launcher!
@@ -66,7 +116,7 @@ class Browse(Scene):
     def __init__(self, games):
         self.games = games
         if options.slideshow:
-            pg.time.set_timer(ADVANCE, options.slideshow * 1000)
+            pg.time.set_timer(ADVANCE, round(options.slideshow * 1000))
         self.handlers = {
             pg.K_RIGHT: self.games.next_game,
             pg.K_LEFT: self.games.previous_game,
@@ -74,21 +124,45 @@ class Browse(Scene):
             pg.K_UP: self.games.previous_letter,
             pg.K_SPACE: self.games.random_game,
         }
+        self.scaled_images = LRUCache(options.scaled_cache_size * 1000000)
+        self.prescaler = Prescaler(self.games.images, self.scaled_images)
+        self.cache = GameCache(self.games) if options.disk_quota else None
+        self.thumbnails = None
+        self.shown = None
+        self.fade_from = None
+        self.advanced = False
         super().__init__()
 
-    def get_events(self):
-        return [pg.event.wait()]
-
     def handle(self, event):
         if event.type == ADVANCE:
-            self.games.random_game()
+            self.advanced = True
+            if options.crossfade:
+                self.fade_from = self.screen.copy()
+                self.fade_start = time.monotonic()
+            self.games.next_slide()
+            self.invalidate()
+        if event.type == GAMES_CHANGED:
+            self.invalidate()
+        if event.type == pg.VIDEORESIZE:
+            self.scaled_images.clear()
         if event.type == pg.KEYDOWN:
+            self.invalidate()
+            self.fade_from = None
+            self.advanced = False
             if event.key == pg.K_ESCAPE:
                 return False
-            if handler := self.handlers.get(event.key):
+            if event.key == pg.K_TAB:
+                return Search(self)
+            if event.key == pg.K_F2:
+                if not self.thumbnails:
+                    self.thumbnails = Thumbnails(self.games.images, lambda: pg.event.post(pg.event.Event(THUMBNAILS_READY)))
+                return Wall(self)
+            char = event.unicode
+            if char and char.isprintable() and (char != ' ' or self.games.typing()):
+                self.games.type_ahead(char)
+            elif handler := self.handlers.get(event.key):
+                self.games.typed = ''
                 handler()
-            if event.unicode:
-                self.games.letter(event.unicode)
             if event.key == pg.K_RETURN:
                 game = self.games.get_current_game()
                 if event.mod & pg.KMOD_SHIFT:
@@ -98,16 +172,232 @@ class Browse(Scene):
                 if game.is_ready():
 
                     # Start playing (spawns a new thread)
-                    game.start(autorun=not event.mod & pg.KMOD_ALT)
+                    try:
+                        game.start(autorun=not event.mod & pg.KMOD_ALT)
+                    except DOSBoxNotFound as e:
+                        return Message(self, str(e).strip())
 
     def update(self, screen):
-        image = self.games.get_image()
         rect = screen.get_rect()
-        scaled_image = pg.transform.scale(image, rect.size)
-        screen.blit(scaled_image, rect)
+        if changed := self.games.apply_changes():
+            self.shown = None
+        for identifier in changed:
+            self.scaled_images.discard((identifier, rect.size))
+            if self.thumbnails:
+                self.thumbnails.discard(identifier)
+        key = self.games.get_current_game().identifier, rect.size
+        if key != self.shown:
+            pinned = [key]
+            if options.slideshow:
+                # The next slide stays cached until it is shown
+                upcoming = self.games.upcoming_slide()
+                pinned.append((upcoming.identifier, rect.size))
+            self.scaled_images.pin(pinned)
+        scaled_image = self.scaled_images.get(key)
+        if scaled_image is None:
+            image = self.games.get_image()
+            with timed('scale'):
+                scaled_image = scale(image, rect.size).convert()
+            self.scaled_images.put(key, scaled_image)
+        if key != self.shown:
+            self.shown = key
+            neighbours = self.games.neighbours()
+            if options.slideshow:
+                neighbours.insert(0, upcoming)
+            self.prescaler.prefetch(neighbours, rect.size)
+            if self.cache and not self.advanced:
+
+                # The slideshow would slowly download every game
+                self.cache.speculate(self.games.nearby(options.speculate))
+        if scaled_image.get_size() != rect.size:
+            screen.fill((0,0,0))
+        screen.blit(scaled_image, scaled_image.get_rect(center=rect.center))
+        if self.fade_from:
+            self.crossfade(screen)
+
+    def crossfade(self, screen):
+        '''Blend the previous slide over the current one, fading it out'''
+        progress = (time.monotonic() - self.fade_start) / options.crossfade
+        if progress >= 1 or self.fade_from.get_size() != screen.get_size():
+            self.fade_from = None
+            return
+        self.fade_from.set_alpha(round(255 * (1 - progress)))
+        screen.blit(self.fade_from, (0,0))
+        self.invalidate()
+
+
+class Search(Scene):
+    def __init__(self, browse):
+        self.browse = browse
+        self.games = browse.games
+        self.query = ''
+        self.results = []
+        self.selected = 0
+        super().__init__()
+
+    def handle(self, event):
+        if event.type == pg.KEYDOWN:
+            self.invalidate()
+            if event.key == pg.K_ESCAPE:
+                return self.browse
+            if event.key == pg.K_RETURN:
+                if self.results:
+                    self.games.select(self.results[self.selected])
+                return self.browse
+            if event.key == pg.K_DOWN:
+                self.selected = min(self.selected + 1, max(len(self.results) - 1, 0))
+            elif event.key == pg.K_UP:
+                self.selected = max(self.selected - 1, 0)
+            elif event.key == pg.K_BACKSPACE:
+                self.query = self.query[:-1]
+                self.search()
+            elif event.unicode and event.unicode.isprintable():
+                self.query += event.unicode
+                self.search()
+
+    def search(self):
+        self.results = self.games.search(self.query)
+        self.selected = 0
+
+    def update(self, screen):
+        lines = [f'Search: {self.query}_', '']
+        for i, identifier in enumerate(self.results):
+            title, year = self.games.index.games[identifier]
+            marker = '>' if i == self.selected else ' '
+            lines.append(f'{marker} {describe(title, year)}')
+        screen.fill((0,0,0))
+        self.draw(screen, '\n'.join(lines))
+
+
+class Wall(Scene):
+    '''
+    Shows the title screens of many games at once, as thumbnails (see
+    thumbnails.py). The selection is the current game of the game
+    list, so Browse continues where the wall left off.
+
+    '''
+    gap = 8
+    bar_height = 40
+    preload_rows = 2
+    scroll_half_life = 0.04  # seconds
+
+    def __init__(self, browse):
+        self.browse = browse
+        self.games = browse.games
+        self.thumbnails = browse.thumbnails
+        self.scroll = None
+        self.scrolled_at = time.monotonic()
+        super().__init__()
+
+    def layout(self, rect):
+        '''Return the number of columns, the cell size and the grid area'''
+        w, h = self.thumbnails.size
+        cell = w + self.gap, h + self.gap
+        columns = max(1, (rect.width - self.gap) // cell[0])
+        view = pg.Rect(0, 0, rect.width, rect.height - self.bar_height)
+        return columns, cell, view
+
+    def handle(self, event):
+        if event.type == THUMBNAILS_READY:
+            self.invalidate()
+        if event.type == pg.KEYDOWN:
+            self.invalidate()
+            columns, cell, view = self.layout(self.screen.get_rect())
+            page = max(1, view.height // cell[1]) * columns
+            games = self.games
+            moves = {
+                pg.K_RIGHT: 1,
+                pg.K_LEFT: -1,
+                pg.K_DOWN: columns,
+                pg.K_UP: -columns,
+                pg.K_PAGEDOWN: page,
+                pg.K_PAGEUP: -page,
+            }
+            if event.key in (pg.K_ESCAPE, pg.K_F2, pg.K_RETURN):
+                return self.browse
+            if event.key in moves:
+                games.typed = ''
+                games.current_game = min(max(games.current_game + moves[event.key], 0), len(games) - 1)
+            elif event.key == pg.K_HOME:
+                games.current_game = 0
+            elif event.key == pg.K_END:
+                games.current_game = len(games) - 1
+            elif event.unicode and event.unicode.isprintable():
+                games.type_ahead(event.unicode)
+
+    def update(self, screen):
+        self.thumbnails.collect()
+        rect = screen.get_rect()
+        columns, cell, view = self.layout(rect)
+        games = self.games
+        identifiers = games.identifiers
+        rows = (len(identifiers) + columns - 1) // columns
+
+        # Scroll smoothly to the row of the current game
+        row = games.current_game // columns
+        target = min(max(self.scroll or 0, (row + 1) * cell[1] + self.gap - view.height), row * cell[1])
+        now = time.monotonic()
+        if self.scroll is None:
+            self.scroll = target
+        self.scroll += (target - self.scroll) * (1 - 0.5 ** ((now - self.scrolled_at) / self.scroll_half_life))
+        self.scrolled_at = now
+        if abs(target - self.scroll) < 0.5:
+            self.scroll = target
+        else:
+            self.invalidate()
+
+        first_row = int(self.scroll) // cell[1]
+        last_row = min((int(self.scroll) + view.height) // cell[1], rows - 1)
+        wanted = list(range(first_row, last_row + 1))
+        wanted += range(last_row + 1, min(last_row + 1 + self.preload_rows, rows))
+        wanted += range(first_row - 1, max(first_row - 1 - self.preload_rows, -1), -1)
+        self.thumbnails.request(
+            (identifiers[i], os.path.join(games.games_dir, identifiers[i], 'title.png'))
+            for r in wanted for i in range(r * columns, min((r + 1) * columns, len(identifiers)))
+        )
+
+        screen.fill((0,0,0))
+        screen.set_clip(view)
+        left = (rect.width - columns * cell[0] + self.gap) // 2
+        blits = []
+        for r in range(first_row, last_row + 1):
+            for i in range(r * columns, min((r + 1) * columns, len(identifiers))):
+                position = left + (i % columns) * cell[0], self.gap + r * cell[1] - round(self.scroll)
+                if thumbnail := self.thumbnails.get(identifiers[i]):
+                    blits.append((thumbnail[0], position, thumbnail[1]))
+                else:
+                    screen.fill((40,40,40), (position, self.thumbnails.size))
+        screen.blits(blits, doreturn=False)
+        selected = games.current_game
+        position = left + (selected % columns) * cell[0], self.gap + row * cell[1] - round(self.scroll)
+        pg.draw.rect(screen, (255,255,255), pg.Rect(position, self.thumbnails.size).inflate(6, 6), 3)
+        screen.set_clip(None)
+
+        title, year = games.titles[selected] or identifiers[selected], games.years[selected]
+        font = get_font('monospace', 24)
+        screen.blit(font.render(describe(title, year), (255,255,255)), (15, view.bottom + 8))
+
+
+class Message(Scene):
+    '''Shows a message until a key is pressed, then returns to Browse'''
+
+    def __init__(self, browse, text):
+        self.browse = browse
+        self.text = text
+        super().__init__()
+
+    def handle(self, event):
+        if event.type == pg.KEYDOWN:
+            return self.browse
+
+    def update(self, screen):
+        screen.fill((0,0,0))
+        self.draw(screen, self.text + '\n\nPress any key to continue')
 
 
 class Download(Scene):
+    refresh_rate = 4
+
     def __init__(self, game):
         self.game = game
         super().__init__()
@@ -124,4 +414,4 @@ class Download(Scene):
         if self.game.download_completed():
             return False
         screen.fill((0,0,0))
-        self.draw(screen, f'Downloading {self.game.urls[0]} ({self.game.get_size():.1f} MB)')
+        self.draw(screen, str(self.game.progress))
@@ -0,0 +1,183 @@
+'''
+Central download scheduler. Games are downloaded by a bounded pool of
+worker threads, in order of priority, while a shared throttle limits
+the total bandwidth. The queue is saved to disk on every change, so
+that a mirroring job (see --slurp-mode) continues after a restart.
+
+Games that the user is waiting for are submitted with URGENT priority
+and start right away, even if all workers are busy.
+
+'''
+import os
+import json
+import time
+import heapq
+import itertools
+from threading import Thread, Condition, Lock
+
+from . import options
+
+URGENT = 0
+NORMAL = 1
+BACKGROUND = 2
+
+
+class Throttle:
+    '''Token bucket that limits the combined rate of all downloads'''
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.allowance = 0
+        self.last = time.monotonic()
+        self.lock = Lock()
+
+    def __call__(self, nbytes):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.allowance + (now - self.last) * self.rate, self.rate)
+            self.last = now
+            self.allowance -= nbytes
+            delay = -self.allowance / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Scheduler:
+    def __init__(self):
+        self.queue = []
+        self.priorities = {}
+        self.games = {}
+        self.active = {}
+        self.running = {}
+        self.counter = itertools.count()
+        self.condition = Condition()
+        self.throttle = Throttle()
+        self.queuefile = None
+        self.workers = []
+
+    def start(self, queuefile=None):
+        '''Start the workers and optionally enable the persistent queue'''
+        self.throttle.rate = options.bandwidth_limit * 1000
+        self.queuefile = queuefile
+        while len(self.workers) < options.download_workers:
+            worker = Thread(target=self.work, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def restore(self, find_game):
+        '''Resubmit the games in the saved queue. find_game returns the Game with an identifier, or None.'''
+        try:
+            with open(self.queuefile, 'r') as f:
+                queue = json.load(f)
+        except (OSError, TypeError, ValueError):
+            return
+        by_priority = {}
+        for identifier, priority in queue:
+            if game := find_game(identifier):
+                by_priority.setdefault(max(priority, NORMAL), []).append(game)
+        for priority, games in sorted(by_priority.items()):
+            self.submit_many(games, priority)
+
+    def save(self):
+        if not self.queuefile:
+            return
+        queue = sorted({**self.priorities, **self.active}.items(), key=lambda item: item[1])
+        try:
+            os.makedirs(os.path.dirname(self.queuefile), exist_ok=True)
+            with open(self.queuefile + '.tmp', 'w') as f:
+                json.dump(queue, f)
+            os.replace(self.queuefile + '.tmp', self.queuefile)
+        except OSError:
+            pass
+
+    def submit(self, game, priority=NORMAL):
+        '''
+        Queue a game for downloading. If the game is already queued,
+        its priority is raised if necessary.
+
+        '''
+        self.submit_many([game], priority)
+
+    def submit_many(self, games, priority=NORMAL):
+        '''Queue several games like submit(), saving the queue only once'''
+        with self.condition:
+            changed = False
+            for game in games:
+                identifier = game.identifier
+                if identifier in self.active or priority >= self.priorities.get(identifier, priority + 1):
+                    continue
+                changed = True
+                if priority == URGENT:
+                    self.priorities.pop(identifier, None)
+                    self.games.pop(identifier, None)
+                    self.active[identifier] = priority
+                    self.running[identifier] = game
+                    Thread(target=self.run, args=(game,), daemon=True).start()
+                else:
+                    self.priorities[identifier] = priority
+                    self.games[identifier] = game
+                    heapq.heappush(self.queue, (priority, next(self.counter), identifier))
+            if changed:
+                self.condition.notify_all()
+                self.save()
+
+    def cancel(self, game):
+        '''Remove a game from the queue. Downloads that already started continue.'''
+        with self.condition:
+            if self.priorities.pop(game.identifier, None) is not None:
+                self.games.pop(game.identifier, None)
+                self.save()
+
+    def report(self, interval):
+        '''Print the progress of all active downloads every interval seconds'''
+        while True:
+            time.sleep(interval)
+            with self.condition:
+                active = [game for game in self.running.values()]
+                queued = len(self.priorities)
+            for game in active:
+                print(str(game.progress).replace('\n', ': '))
+            print(f'{queued} games waiting to be downloaded')
+
+    def start_reporting(self, interval=10):
+        Thread(target=self.report, args=(interval,), daemon=True).start()
+
+    def is_busy(self, game):
+        '''Return True if the game is queued or being downloaded'''
+        with self.condition:
+            return game.identifier in self.active or game.identifier in self.priorities
+
+    def next_game(self):
+        '''Wait for the next queued game and mark it active'''
+        with self.condition:
+            while True:
+                while not self.queue:
+                    self.condition.wait()
+                priority, _, identifier = heapq.heappop(self.queue)
+
+                # Skip entries that were resubmitted with a different priority
+                if self.priorities.get(identifier) == priority:
+                    del self.priorities[identifier]
+                    self.active[identifier] = priority
+                    self.running[identifier] = self.games.pop(identifier)
+                    return self.running[identifier]
+
+    def work(self):
+        while True:
+            self.run(self.next_game())
+
+    def run(self, game):
+        try:
+            game.download_now(self.throttle)
+        except Exception as e:
+            print(f'Error downloading {game.identifier}: {e}')
+        finally:
+            with self.condition:
+                self.active.pop(game.identifier, None)
+                self.running.pop(game.identifier, None)
+                self.save()
+
+
+scheduler = Scheduler()
@@ -0,0 +1,139 @@
+'''
+Full-text search over the title, identifier and year of all games.
+
+The index maps every token to the games that contain it. Query
+tokens match index tokens exactly, by prefix, or (for tokens of
+four characters or more) with one typo, in decreasing order of
+relevance. Typos are found with a table of all single-character
+deletions of every token, so that no edit distances have to be
+computed at query time.
+
+'''
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Thread, Event
+
+TOKEN = re.compile(r'\w+')
+FIELD_WEIGHTS = {'title': 3, 'identifier': 2, 'year': 1}
+EXACT, PREFIX, TYPO = 1.0, 0.6, 0.3
+MIN_TYPO_LENGTH = 4
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower()) if text else []
+
+
+def deletions(token):
+    '''Return all variants of token with one character deleted'''
+    return {token[:i] + token[i+1:] for i in range(len(token))}
+
+
+class SearchIndex:
+    def __init__(self):
+        self.ready = Event()
+        self.postings = defaultdict(dict)
+        self.vocabulary = []
+        self.typos = defaultdict(set)
+        self.games = {}
+
+    def start(self, entries):
+        '''Build the index from (identifier, title, year) tuples in a background thread'''
+        Thread(target=self.build, args=(entries,), daemon=True).start()
+
+    def build(self, entries):
+        for identifier, title, year in entries:
+            self.insert(identifier, title, year)
+        self.update_vocabulary()
+        self.ready.set()
+
+    def add(self, identifier, title, year):
+        self.insert(identifier, title, year)
+        self.update_vocabulary()
+
+    def insert(self, identifier, title, year):
+        self.games[identifier] = title or identifier, year
+        fields = {'title': title, 'identifier': identifier, 'year': year}
+        for field, text in fields.items():
+            for token in tokenize(text):
+                postings = self.postings[token]
+                postings[identifier] = max(postings.get(identifier, 0), FIELD_WEIGHTS[field])
+
+    def remove(self, identifier):
+        self.delete(identifier)
+        self.update_vocabulary()
+
+    def update(self, entries, removed=()):
+        '''Add or replace the given games, remove others, and update the vocabulary once'''
+        for identifier in removed:
+            self.delete(identifier)
+        for identifier, title, year in entries:
+            self.delete(identifier)
+            self.insert(identifier, title, year)
+        self.update_vocabulary()
+
+    def delete(self, identifier):
+        if (game := self.games.pop(identifier, None)) is None:
+            return
+        title, year = game
+        for token in set(tokenize(title) + tokenize(identifier) + tokenize(year)):
+            postings = self.postings.get(token)
+            if postings is not None:
+                postings.pop(identifier, None)
+                if not postings:
+                    del self.postings[token]
+
+    def update_vocabulary(self):
+        if len(self.postings) == len(self.vocabulary) and self.postings.keys() == set(self.vocabulary):
+            return
+        self.vocabulary = sorted(self.postings)
+        self.typos.clear()
+        for token in self.vocabulary:
+            if len(token) >= MIN_TYPO_LENGTH:
+                for deletion in deletions(token):
+                    self.typos[deletion].add(token)
+
+    def matches(self, query_token):
+        '''Return a dict of the index tokens that match query_token and their relevance'''
+        matches = {}
+        if len(query_token) >= MIN_TYPO_LENGTH:
+            variants = deletions(query_token)
+            candidates = set(self.typos.get(query_token, ()))
+            for variant in variants:
+                candidates.update(self.typos.get(variant, ()))
+                if variant in self.postings:
+                    candidates.add(variant)
+            for token in candidates:
+                matches[token] = TYPO
+
+        i = bisect_left(self.vocabulary, query_token)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(query_token):
+            matches[self.vocabulary[i]] = PREFIX
+            i += 1
+
+        if query_token in self.postings:
+            matches[query_token] = EXACT
+        return matches
+
+    def search(self, query, limit=20):
+        '''
+        Return the identifiers of the games that match all tokens of
+        the query, best matches first
+
+        '''
+        scores = None
+        for query_token in tokenize(query):
+            token_scores = defaultdict(float)
+            for token, relevance in self.matches(query_token).items():
+                for identifier, weight in self.postings[token].items():
+                    token_scores[identifier] = max(token_scores[identifier], relevance * weight)
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {
+                    identifier: score + token_scores[identifier]
+                    for identifier, score in scores.items() if identifier in token_scores
+                }
+        if not scores:
+            return []
+        return sorted(scores, key=lambda identifier: (-scores[identifier], identifier.lower()))[:limit]
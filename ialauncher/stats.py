@@ -0,0 +1,149 @@
+'''
+Play statistics: which games are launched, when, for how long, and
+which ones are downloaded. They are kept in an SQLite database in the
+data directory, and used to have the most popular games ready before
+anyone asks for them.
+
+Writes are queued and committed in batches by a background thread,
+so that recording a launch or download never blocks the UI.
+
+'''
+import os
+import time
+import atexit
+import sqlite3
+from queue import Queue, Empty
+from threading import Thread, Lock
+
+from . import options
+
+FILENAME = 'stats.sqlite'
+BATCH_INTERVAL = 1  # seconds
+FLUSH_TIMEOUT = 5  # seconds
+HALF_LIFE = 30 * 24 * 3600  # seconds
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS games (
+        identifier TEXT PRIMARY KEY,
+        launches INTEGER NOT NULL DEFAULT 0,
+        play_time REAL NOT NULL DEFAULT 0,
+        last_played REAL,
+        downloaded INTEGER NOT NULL DEFAULT 0,
+        downloaded_at REAL
+    );
+    CREATE TABLE IF NOT EXISTS launches (
+        identifier TEXT NOT NULL,
+        started REAL NOT NULL,
+        duration REAL NOT NULL,
+        exit_code INTEGER
+    );
+'''
+
+
+class Stats:
+    def __init__(self, path=None):
+        self.path = path
+        self.queue = Queue()
+        self.lock = Lock()
+        self.writer = None
+
+    def connect(self):
+        path = self.path or os.path.join(options.data_dir, FILENAME)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        db = sqlite3.connect(path, timeout=10)
+        db.executescript(SCHEMA)
+        return db
+
+    def write(self, sql, *params):
+        '''Queue a statement for the writer thread, starting it if necessary'''
+        with self.lock:
+            if not self.writer:
+                self.writer = Thread(target=self.write_batches, daemon=True)
+                self.writer.start()
+                atexit.register(self.flush)
+        self.queue.put((sql, params))
+
+    def write_batches(self):
+        try:
+            db = self.connect()
+        except (OSError, sqlite3.Error) as e:
+            print('Could not save statistics:', e)
+
+            # Keep taking statements off the queue, so that flush() returns
+            db = None
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + BATCH_INTERVAL
+            while (timeout := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except Empty:
+                    break
+            try:
+                if db:
+                    with db:
+                        for sql, params in batch:
+                            db.execute(sql, params)
+            except sqlite3.Error as e:
+                print('Could not save statistics:', e)
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        '''Wait (at most timeout seconds) until all queued statements have been written'''
+        if not self.writer:
+            return
+        deadline = time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                if (remaining := deadline - time.monotonic()) <= 0:
+                    print('Gave up saving statistics')
+                    return
+                self.queue.all_tasks_done.wait(remaining)
+
+    def read(self, sql, *params):
+        try:
+            db = self.connect()
+            try:
+                return db.execute(sql, params).fetchall()
+            finally:
+                db.close()
+        except (OSError, sqlite3.Error) as e:
+            print('Could not read statistics:', e)
+            return []
+
+    def record_launch(self, identifier, started, duration, exit_code):
+        self.write('INSERT INTO launches VALUES (?, ?, ?, ?)', identifier, started, duration, exit_code)
+        self.write('INSERT OR IGNORE INTO games (identifier) VALUES (?)', identifier)
+        self.write(
+            'UPDATE games SET launches = launches + 1, play_time = play_time + ?, last_played = ? WHERE identifier = ?',
+            duration, started + duration, identifier,
+        )
+
+    def record_download(self, identifier, downloaded=True):
+        self.write('INSERT OR IGNORE INTO games (identifier) VALUES (?)', identifier)
+        self.write(
+            'UPDATE games SET downloaded = ?, downloaded_at = ? WHERE identifier = ?',
+            int(downloaded), time.time() if downloaded else None, identifier,
+        )
+
+    def popularity(self):
+        '''
+        Return a dict of identifier -> score, for all games that were
+        ever played. The score counts launches and hours played, and
+        halves for every HALF_LIFE since the game was last played.
+
+        '''
+        now = time.time()
+        return {
+            identifier: (launches + play_time / 3600) * 0.5 ** (max(now - last_played, 0) / HALF_LIFE)
+            for identifier, launches, play_time, last_played in self.read(
+                'SELECT identifier, launches, play_time, last_played FROM games WHERE launches > 0'
+            )
+        }
+
+    def last_played(self):
+        '''Return a dict of identifier -> time last played'''
+        return dict(self.read('SELECT identifier, last_played FROM games WHERE last_played IS NOT NULL'))
+
+
+stats = Stats()
@@ -0,0 +1,218 @@
+'''
+Optional content-addressed store for extracted game files.
+
+Many games ship the same files (DOS4GW.EXE, sound drivers, shared
+engine data). When deduplication is enabled, every extracted file is
+looked up in the store by its CRC-32 and size, which the zip file
+already provides. If an identical object exists, the file becomes a
+link to it; otherwise the file is added to the store.
+
+Links are reflinks (copy-on-write clones) where the filesystem
+supports them, and hardlinks elsewhere. Hardlinked objects are made
+read-only, and a game's hardlinked files get their own copy when it
+is started (in the DOSBox thread, see game.py), so that a game can't
+change the files of other games. This means that games lose their
+deduplication once they're played, unless the filesystem supports
+reflinks.
+On Windows, where hardlinks can't be protected this way and reflinks
+aren't available, deduplication is disabled.
+
+Small files are never deduplicated, because those are typically
+config files that games write to and that don't take much space.
+
+'''
+import os
+import stat
+import shutil
+import filecmp
+from threading import Lock
+
+from . import options
+
+FICLONE = 0x40049409
+DIRNAME = '.store'
+stores = {}
+
+
+def get_store(games_dir):
+    '''Return the store of a games directory, or None if deduplication is disabled'''
+    if not options.dedup or os.name == 'nt':
+        return None
+    if games_dir not in stores:
+        try:
+            stores[games_dir] = Store(os.path.join(games_dir, DIRNAME))
+        except OSError as e:
+            print('Deduplication disabled:', e)
+            stores[games_dir] = None
+    return stores[games_dir]
+
+
+def reflink(src, dest):
+    '''Create a copy-on-write clone of src at dest (Linux only)'''
+    import fcntl
+    with open(src, 'rb') as s, open(dest, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+class Store:
+    def __init__(self, root):
+        self.root = root
+        self.lock = Lock()
+        self.reflinks = self.supports_reflinks()
+
+    def supports_reflinks(self):
+        os.makedirs(self.root, exist_ok=True)
+        probe = os.path.join(self.root, 'probe')
+        with open(probe, 'wb') as f:
+            f.write(b'probe')
+        try:
+            reflink(probe, probe + '.clone')
+            return True
+        except (ImportError, OSError):
+            return False
+        finally:
+            for path in (probe, probe + '.clone'):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def object_path(self, crc, size):
+        name = f'{crc:08x}-{size:x}'
+        return os.path.join(self.root, name[:2], name)
+
+    def clone(self, src, dest):
+        if self.reflinks:
+            reflink(src, dest)
+        else:
+            os.link(src, dest)
+
+    def link(self, obj, dest):
+        '''Replace dest with a link to obj'''
+        self.clone(obj, dest + '.tmp')
+        os.replace(dest + '.tmp', dest)
+
+    def add(self, path, crc, size):
+        '''
+        Deduplicate the file at path, of which the CRC-32 and size are
+        known. Returns True if the file is now linked to the store.
+
+        '''
+        if size < options.dedup_min_size:
+            return False
+        obj = self.object_path(crc, size)
+        with self.lock:
+            try:
+                if os.path.exists(obj):
+                    if os.path.samefile(obj, path):
+                        return True
+                    if not filecmp.cmp(obj, path, shallow=False):
+                        return False
+                    self.link(obj, path)
+                else:
+                    os.makedirs(os.path.dirname(obj), exist_ok=True)
+                    self.clone(path, obj)
+                    self.protect(obj)
+                return True
+            except OSError:
+                return False
+
+    def protect(self, obj):
+        '''Make a hardlinked object read-only'''
+        if not self.reflinks and os.name == 'posix':
+            os.chmod(obj, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+    def writer(self, dest, crc, size):
+        '''
+        Return a file-like object for extracting a file to dest. If
+        the store already has an object with the given CRC-32 and size,
+        the data is only compared to the object and dest becomes a link
+        to it, without writing anything.
+
+        '''
+        if os.path.exists(dest):
+            os.remove(dest)
+        obj = self.object_path(crc, size)
+        if size >= options.dedup_min_size and os.path.exists(obj):
+            return Writer(self, dest, obj)
+        return open(dest, 'wb')
+
+    def collect(self):
+        '''
+        Remove hardlinked objects that are no longer used by any game.
+        Reflinked objects don't know whether they're used, so they stay.
+
+        '''
+        if self.reflinks:
+            return
+        with self.lock:
+            for dirpath, dirnames, filenames in os.walk(self.root):
+                for filename in filenames:
+                    obj = os.path.join(dirpath, filename)
+                    if os.stat(obj).st_nlink == 1:
+                        os.remove(obj)
+
+    def unshare(self, path):
+        '''
+        Give the hardlinked file at path, or all hardlinked files below
+        it, their own copy so that they can be modified. This is done
+        before a game is started, because any game may write to the
+        files it shipped with.
+
+        '''
+        if os.path.isfile(path):
+            filepaths = [path]
+        else:
+            filepaths = [os.path.join(dirpath, f) for dirpath, _, filenames in os.walk(path) for f in filenames]
+        for filepath in filepaths:
+            st = os.stat(filepath)
+            if st.st_nlink > 1:
+                shutil.copyfile(filepath, filepath + '.tmp')
+
+                # Keep the modification time, which tells saves apart (see gamecache.py)
+                os.utime(filepath + '.tmp', ns=(st.st_atime_ns, st.st_mtime_ns))
+                os.replace(filepath + '.tmp', filepath)
+
+
+class Writer:
+    '''Compares extracted data to a store object, and only writes when it differs'''
+
+    def __init__(self, store, dest, obj):
+        self.store = store
+        self.dest = dest
+        self.obj = obj
+        self.compare = open(obj, 'rb')
+        self.file = None
+        self.position = 0
+
+    def write(self, data):
+        if self.compare:
+            if self.compare.read(len(data)) == data:
+                self.position += len(data)
+                return
+            self.diverge()
+        self.file.write(data)
+
+    def diverge(self):
+        '''The data differs from the object: write a private copy after all'''
+        self.compare.seek(0)
+        self.file = open(self.dest, 'wb')
+        self.file.write(self.compare.read(self.position))
+        self.compare.close()
+        self.compare = None
+
+    def close(self):
+        if self.compare:
+            if self.compare.read(1):
+                self.diverge()
+            else:
+                self.compare.close()
+                self.store.link(self.obj, self.dest)
+                return
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,98 @@
+'''
+Text layout for Scene.draw().
+
+Measuring text with pygame is slow, and so is rendering it, while the
+text on screen rarely changes from one frame to the next. Therefore,
+each font remembers the advance (width) of every character it has
+seen, so that line breaks can be found without calling font.size().
+The resulting layouts and the rendered lines are cached, so that
+redrawing unchanged text only costs a few blits.
+
+'''
+from collections import OrderedDict
+import pygame as pg
+
+from .imagecache import LRUCache
+
+LINE_CACHE_SIZE = 8  # megabytes
+MAX_LAYOUTS = 256
+fonts = {}
+
+
+def get_font(family, size):
+    '''Return the (shared) Font with the given family and size'''
+    key = family, size
+    if key not in fonts:
+        fonts[key] = Font(family, size)
+    return fonts[key]
+
+
+class Font:
+    def __init__(self, family, size):
+        self.font = pg.font.SysFont(family, size)
+        self.advances = {}
+        self.layouts = OrderedDict()
+        self.lines = LRUCache(LINE_CACHE_SIZE * 1000000)
+
+    def advance(self, char):
+        try:
+            return self.advances[char]
+        except KeyError:
+            advance = self.advances[char] = self.font.size(char)[0]
+            return advance
+
+    def width(self, text):
+        return sum(self.advance(char) for char in text)
+
+    def wrap(self, text, width):
+        '''
+        Split text into lines that are at most width pixels wide,
+        breaking at spaces where possible. Empty lines are skipped.
+
+        '''
+        key = text, width
+        if key in self.layouts:
+            self.layouts.move_to_end(key)
+            return self.layouts[key]
+
+        lines = []
+        for paragraph in text.split('\n'):
+            start = 0
+            space = None
+            x = 0
+            for i, char in enumerate(paragraph):
+                advance = self.advance(char)
+                if x + advance > width and i > start:
+                    if char == ' ':
+                        lines.append(paragraph[start:i])
+                        start = i + 1
+                        space = None
+                        x = 0
+                        continue
+                    if space is not None and space > start:
+                        lines.append(paragraph[start:space])
+                        start = space + 1
+                    else:
+                        lines.append(paragraph[start:i])
+                        start = i
+                    space = None
+                    x = self.width(paragraph[start:i])
+                if char == ' ':
+                    space = i
+                x += advance
+            if paragraph[start:]:
+                lines.append(paragraph[start:])
+
+        self.layouts[key] = lines
+        if len(self.layouts) > MAX_LAYOUTS:
+            self.layouts.popitem(last=False)
+        return lines
+
+    def render(self, line, color):
+        '''Return the rendered line, from the cache if possible'''
+        key = line, color
+        image = self.lines.get(key)
+        if image is None:
+            image = self.font.render(line, True, color)
+            self.lines.put(key, image)
+        return image
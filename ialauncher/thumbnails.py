@@ -0,0 +1,102 @@
+'''
+Thumbnails of title screens for the wall view.
+
+Thumbnails are made by background threads, for the rows that are
+about to come into view, and packed into a few large atlas surfaces,
+so that drawing hundreds of them is a single Surface.blits() call
+with a source rect per thumbnail. The atlases hold a fixed number of
+thumbnails; when they are full, the least recently drawn thumbnail
+makes room.
+
+The workers only decode and scale. Copying the results into the
+atlases is done by collect() on the main thread, so that an atlas is
+never written while it is being drawn.
+
+'''
+from collections import OrderedDict
+from threading import Lock
+import pygame as pg
+
+from .worker import Worker
+from . import options
+
+ATLAS_SIZE = 2048  # pixels
+
+
+def make_thumbnail(image, size):
+    '''Scale a title screen down to the thumbnail size'''
+    if image.get_bitsize() < 24:
+        rgb = pg.Surface(image.get_size(), depth=24)
+        rgb.blit(image, (0,0))
+        image = rgb
+    return pg.transform.smoothscale(image, size)
+
+
+class Thumbnails:
+    def __init__(self, images, on_ready=None):
+        self.images = images
+        self.on_ready = on_ready
+        width = options.thumbnail_width
+        self.size = width, width * 3 // 4
+        self.columns = ATLAS_SIZE // self.size[0]
+        self.rows = ATLAS_SIZE // self.size[1]
+        slots_per_atlas = self.columns * self.rows
+        atlas_bytes = ATLAS_SIZE * ATLAS_SIZE * 4
+        self.atlases = [None] * max(1, options.thumbnail_cache_size * 1000000 // atlas_bytes)
+        self.free = list(reversed(range(len(self.atlases) * slots_per_atlas)))
+        self.slots = OrderedDict()
+        self.done = []
+        self.lock = Lock()
+        self.worker = Worker(self.make_pending, options.thumbnail_workers)
+
+    def get(self, identifier):
+        '''Return the atlas and source rect of a thumbnail, or None if it isn't ready'''
+        if (slot := self.slots.get(identifier)) is None:
+            return None
+        self.slots.move_to_end(identifier)
+        atlas, i = divmod(slot, self.columns * self.rows)
+        row, column = divmod(i, self.columns)
+        w, h = self.size
+        return self.atlases[atlas], (column * w, row * h, w, h)
+
+    def request(self, games):
+        '''
+        Make thumbnails of the given (identifier, path) pairs in the
+        background, in order. Replaces any previous requests that
+        weren't handled yet.
+
+        '''
+        self.worker.submit((identifier, path) for identifier, path in games if identifier not in self.slots)
+
+    def discard(self, identifier):
+        '''Forget a thumbnail, for example because its title screen changed'''
+        if (slot := self.slots.pop(identifier, None)) is not None:
+            self.free.append(slot)
+
+    def make_pending(self, request):
+        identifier, path = request
+        thumbnail = make_thumbnail(self.images.decode(identifier, path), self.size)
+        with self.lock:
+            first = not self.done
+            self.done.append((identifier, thumbnail))
+        if first and self.on_ready:
+            self.on_ready()
+
+    def collect(self):
+        '''Copy finished thumbnails into the atlases. Returns True if there were any.'''
+        with self.lock:
+            done, self.done = self.done, []
+        for identifier, thumbnail in done:
+            if identifier in self.slots:
+                continue
+            if not self.free:
+                _, slot = self.slots.popitem(last=False)
+                self.free.append(slot)
+            slot = self.free.pop()
+            atlas = slot // (self.columns * self.rows)
+            if self.atlases[atlas] is None:
+                self.atlases[atlas] = pg.Surface((ATLAS_SIZE, ATLAS_SIZE)).convert()
+            self.slots[identifier] = slot
+            surface, area = self.get(identifier)
+            surface.blit(thumbnail, area[:2])
+        return bool(done)
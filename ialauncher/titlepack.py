@@ -0,0 +1,111 @@
+'''
+The title pack is a single file that contains the title screens of
+all games as raw 8-bit indexed pixels, so that they can be turned
+into surfaces straight from a memory-mapped buffer, without opening
+and decoding thousands of PNG files. Build it with:
+
+    python -m ialauncher.titlepack
+
+Only palettized title screens of up to 320x240 pixels (which is the
+vast majority) are packed. For all other games, the original
+title.png is used. So is a title.png that was changed after the pack
+was built, which is noticed by its modification time and size.
+
+'''
+import os, sys
+import json
+import mmap
+import struct
+import pygame as pg
+
+FILENAME = 'titles.pack'
+MAGIC = b'IATP'
+VERSION = 2
+HEADER = struct.Struct('<4sIQ')
+MAX_PIXELS = 320 * 240
+
+
+class TitlePack:
+    '''
+    Read-only access to a title pack. The index maps each identifier
+    to the offset, width and height of its title screen, and the
+    modification time and size of the title.png it was made from. At
+    the given offset are 768 bytes of palette, followed by
+    width*height bytes of pixels.
+
+    '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, index_offset = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a valid title pack')
+        self.index = json.loads(self.buffer[index_offset:])
+
+    @classmethod
+    def open(cls, games_dir):
+        '''Return the title pack of the given games directory, if any'''
+        try:
+            return cls(os.path.join(games_dir, FILENAME))
+        except (OSError, ValueError):
+            return None
+
+    def __contains__(self, identifier):
+        return identifier in self.index
+
+    def get(self, identifier, path):
+        '''
+        Return the title screen of a game, or None if it wasn't packed
+        or if the title.png at path changed since it was packed
+
+        '''
+        if identifier not in self.index or path is None:
+            return None
+        offset, width, height, mtime, size = self.index[identifier]
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_mtime_ns != mtime or st.st_size != size:
+            return None
+        palette = self.buffer[offset:offset + 768]
+        pixels = memoryview(self.buffer)[offset + 768:offset + 768 + width * height]
+        surface = pg.image.frombuffer(pixels, (width, height), 'P')
+        surface.set_palette([tuple(palette[i:i+3]) for i in range(0, 768, 3)])
+        return surface
+
+
+def build(games_dir):
+    '''Pack the title screens of all games in the given directory'''
+    path = os.path.join(games_dir, FILENAME)
+    index = {}
+    with open(path + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0))
+        for identifier in sorted(os.listdir(games_dir)):
+            title = os.path.join(games_dir, identifier, 'title.png')
+            try:
+                st = os.stat(title)
+                image = pg.image.load(title)
+            except (OSError, pg.error):
+                continue
+            width, height = image.get_size()
+            if image.get_bitsize() != 8 or width * height > MAX_PIXELS:
+                continue
+            palette = list(image.get_palette())
+            palette = palette + [(0,0,0)] * (256 - len(palette))
+            index[identifier] = [f.tell(), width, height, st.st_mtime_ns, st.st_size]
+            f.write(bytes(c for color in palette for c in color[:3]))
+            f.write(pg.image.tobytes(image, 'P'))
+        index_offset = f.tell()
+        f.write(json.dumps(index, separators=(',', ':')).encode())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, index_offset))
+    os.replace(path + '.tmp', path)
+    return len(index)
+
+
+if __name__ == '__main__':
+    import games as gd
+    games_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(gd.__file__)
+    print(f'Packed {build(games_dir)} title screens into {os.path.join(games_dir, FILENAME)}')
@@ -0,0 +1,178 @@
+'''
+Extract a zip file while it is still being downloaded.
+
+Instead of reading the central directory at the end of the file, the
+local file headers that precede each member are parsed one by one,
+so that each member can be extracted as soon as its bytes arrive.
+This works for stored and deflated members, which covers nearly all
+archives in the Internet Archive. Anything else raises Unsupported,
+after which the caller should wait for the download to finish and
+fall back to the zipfile module.
+
+'''
+import os
+import zlib
+import struct
+
+from .fetch import DownloadError
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+STORED, DEFLATED = 0, 8
+CHUNK_SIZE = 64 * 1024
+
+
+class Unsupported(Exception):
+    pass
+
+
+class PartReader:
+    '''File-like object that reads a file while a Fetch is downloading it'''
+
+    def __init__(self, fetch):
+        self.fetch = fetch
+        self.file = None
+        self.offset = 0
+
+    def read(self, n):
+        available = self.fetch.wait(self.offset + n)
+        if available < self.offset + n and self.fetch.errors:
+            raise DownloadError(self.fetch.errors[0])
+        if self.file is None:
+            self.file = open(self.fetch.part, 'rb')
+        data = self.file.read(min(n, available - self.offset))
+        self.offset += len(data)
+        return data
+
+    def unread(self, n):
+        '''Go back n bytes'''
+        self.file.seek(-n, os.SEEK_CUR)
+        self.offset -= n
+
+    def read_exactly(self, n):
+        data = self.read(n)
+        if len(data) < n:
+            raise Unsupported('Unexpected end of file')
+        return data
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def safe_path(root, name):
+    '''Like ZipFile.extract(), ignore absolute paths and parent directories'''
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    if parts:
+        parts[0] = os.path.splitdrive(parts[0])[1] or parts[0]
+    return os.path.join(root, *parts)
+
+
+def zip64_sizes(extra, compressed_size, size):
+    '''
+    Read the real sizes from a zip64 extra field, if any. Returns
+    the sizes and whether the member is in zip64 format.
+
+    '''
+    while len(extra) >= 4:
+        tag, length = struct.unpack('<HH', extra[:4])
+        if tag == 1:
+            values = list(struct.unpack(f'<{length // 8}Q', extra[4:4 + length // 8 * 8]))
+            if size == 0xffffffff and values:
+                size = values.pop(0)
+            if compressed_size == 0xffffffff and values:
+                compressed_size = values.pop(0)
+            return compressed_size, size, True
+        extra = extra[4 + length:]
+    return compressed_size, size, False
+
+
+def stream_extract(reader, path, store=None):
+    '''
+    Extract the zip file that is being read by reader into path,
+    deduplicating files with the given store (if any)
+
+    '''
+    while True:
+        header = reader.read(LOCAL_HEADER.size)
+        if len(header) < 4 or struct.unpack('<I', header[:4])[0] != LOCAL_HEADER_SIGNATURE:
+            if reader.offset == len(header):
+                raise Unsupported('Not a zip file')
+
+            # Reached the central directory
+            return
+        if len(header) < LOCAL_HEADER.size:
+            raise Unsupported('Truncated local file header')
+
+        _, _, flags, method, _, _, crc, compressed_size, size, name_length, extra_length = LOCAL_HEADER.unpack(header)
+        name = reader.read_exactly(name_length).decode('utf-8' if flags & 0x800 else 'cp437')
+        extra = reader.read_exactly(extra_length)
+        compressed_size, size, zip64 = zip64_sizes(extra, compressed_size, size)
+        descriptor = flags & 0x08
+
+        dest = safe_path(path, name)
+        if name.endswith('/'):
+            os.makedirs(dest, exist_ok=True)
+            checksum = 0
+        else:
+            if flags & 0x01:
+                raise Unsupported('Encrypted zip files are not supported')
+            if method not in (STORED, DEFLATED) or (descriptor and method == STORED):
+                raise Unsupported(f'Unsupported compression method for {name}')
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if store and not descriptor:
+                f = store.writer(dest, crc, size)
+            else:
+                f = open(dest, 'wb')
+            with f:
+                checksum = extract_member(reader, f, method, compressed_size, descriptor)
+
+        if descriptor:
+            data = reader.read_exactly(4)
+            if struct.unpack('<I', data)[0] == DATA_DESCRIPTOR_SIGNATURE:
+                data = reader.read_exactly(4)
+            crc = struct.unpack('<I', data)[0]
+            if zip64:
+                compressed_size, size = struct.unpack('<QQ', reader.read_exactly(16))
+            else:
+                compressed_size, size = struct.unpack('<II', reader.read_exactly(8))
+        if checksum != crc:
+            raise Unsupported(f'Bad CRC for {name}')
+        if store and not name.endswith('/'):
+            store.add(dest, crc, size)
+
+
+def extract_member(reader, f, method, compressed_size, descriptor):
+    '''
+    Decompress a single member into f and return its CRC. Members
+    with a data descriptor don't know their size in advance, so we
+    decompress until the end of the deflate stream and hand any
+    bytes we read too many back to the reader.
+
+    '''
+    checksum = 0
+    decompressor = zlib.decompressobj(-15)
+    remaining = compressed_size
+    while descriptor or remaining:
+        chunk = reader.read(CHUNK_SIZE if descriptor else min(CHUNK_SIZE, remaining))
+        if not chunk:
+            raise Unsupported('Unexpected end of file')
+        remaining -= len(chunk)
+        data = chunk if method == STORED else decompressor.decompress(chunk)
+        checksum = zlib.crc32(data, checksum)
+        f.write(data)
+        if descriptor and decompressor.eof:
+            reader.unread(len(decompressor.unused_data))
+            break
+    if method == DEFLATED:
+        data = decompressor.flush()
+        checksum = zlib.crc32(data, checksum)
+        f.write(data)
+    return checksum
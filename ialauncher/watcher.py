@@ -0,0 +1,188 @@
+'''
+Watches the games directory while IA Launcher is running, so that
+games that are added, removed or changed (for example pushed to a
+kiosk) show up without a restart.
+
+On Linux, inotify is used (through ctypes) to watch the games
+directory and each game directory in it. Elsewhere, or when inotify
+runs out of watches, the catalog is rescanned every
+options.watch_interval seconds instead.
+
+Copying a game takes a while, so changes are collected until nothing
+happened for SETTLE_TIME seconds, but no longer than MAX_SETTLE_TIME
+seconds. Events about other files, such as the state files of running
+downloads, are ignored. Then the games directory is scanned for games
+that were added, removed or have a newer metadata.ini. Only the
+modification times are kept in memory; the catalog is loaded to be
+updated when something changed.
+
+'''
+import os
+import time
+import errno
+import select
+import struct
+import ctypes, ctypes.util
+from threading import Thread
+
+from .catalog import Catalog, find_games
+from . import options
+
+SETTLE_TIME = 1  # seconds
+MAX_SETTLE_TIME = 10  # seconds
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+EVENT = struct.Struct('iIII')
+
+GAMES_DIR_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+GAME_MASK = IN_CLOSE_WRITE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+
+# Files in a game directory that change what the game list shows
+WATCHED_FILES = {'metadata.ini', 'title.png'}
+
+
+class Inotify:
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.check(self.libc.inotify_init1(IN_CLOEXEC))
+        self.paths = {}
+
+    def check(self, result):
+        if result < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        return result
+
+    def add_watch(self, path, mask):
+        wd = self.check(self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask))
+        self.paths[wd] = path
+
+    def read(self, timeout=None):
+        '''Wait for events and return them as (path, mask, name) tuples'''
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((self.paths.get(wd), mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher(Thread):
+    '''
+    Calls callback(changed, removed) when games change, where changed
+    is a dict of identifier -> metadata (see Catalog.metadata()) of the
+    games that were added or changed, and removed is a list of the
+    identifiers of the games that were removed. mtimes is a dict of
+    identifier -> modification time of metadata.ini of the games that
+    the caller knows about, as stored in the catalog.
+
+    '''
+
+    def __init__(self, games_dir, callback, mtimes):
+        self.games_dir = games_dir
+        self.callback = callback
+        self.mtimes = mtimes
+        super().__init__(daemon=True)
+
+    def run(self):
+        try:
+            self.watch()
+        except (OSError, AttributeError, TypeError) as e:
+            if getattr(e, 'errno', None) == errno.ENOSPC:
+                print('Too many games for inotify, polling the games directory instead')
+            self.poll()
+
+    def watch(self):
+        inotify = Inotify()
+        try:
+            inotify.add_watch(self.games_dir, GAMES_DIR_MASK)
+            for entry in os.scandir(self.games_dir):
+                if entry.is_dir() and not entry.name.startswith('.'):
+                    inotify.add_watch(entry.path, GAME_MASK)
+
+            # Changes made before the watches were in place, including
+            # edits that the catalog didn't notice at startup
+            self.update()
+            while True:
+                touched = set()
+                settled = deadline = None
+                while settled is None or time.monotonic() < min(settled, deadline):
+                    timeout = None if settled is None else max(min(settled, deadline) - time.monotonic(), 0)
+                    for path, mask, name in inotify.read(timeout):
+                        if mask & IN_Q_OVERFLOW:
+
+                            # Events were lost, but update() scans the games directory anyway
+                            pass
+                        elif path == self.games_dir:
+                            if not mask & IN_ISDIR or name.startswith('.'):
+                                continue
+                            touched.add(name)
+                            if mask & (IN_CREATE | IN_MOVED_TO):
+                                try:
+                                    inotify.add_watch(os.path.join(path, name), GAME_MASK)
+                                except OSError:
+                                    pass
+                        elif path and name in WATCHED_FILES:
+                            touched.add(os.path.basename(path))
+                        else:
+                            continue
+
+                        # Only wait for changes that matter
+                        settled = time.monotonic() + SETTLE_TIME
+                        deadline = deadline or time.monotonic() + MAX_SETTLE_TIME
+                self.update(touched)
+        finally:
+            inotify.close()
+
+    def poll(self):
+        while True:
+            time.sleep(options.watch_interval)
+            self.update()
+
+    def update(self, touched=()):
+        '''Update the catalog and report the changes'''
+        try:
+            dir_mtime = os.stat(self.games_dir).st_mtime_ns
+            found = find_games(self.games_dir)
+            outdated = {identifier for identifier, mtime in found.items() if self.mtimes.get(identifier) != mtime}
+
+            # Titles aren't in the catalog, but inotify reports their changes
+            outdated.update(identifier for identifier in touched if identifier in found)
+            removed = [identifier for identifier in self.mtimes if identifier not in found]
+            self.mtimes = found
+            if not outdated and not removed:
+                return
+
+            catalog = Catalog(self.games_dir)
+            catalog.load()
+            catalog.mtime = dir_mtime
+            for identifier in removed:
+                catalog.entries.pop(identifier, None)
+            changed = {}
+            for identifier in outdated:
+                catalog.read(identifier)
+                if identifier in catalog.entries:
+                    changed[identifier] = catalog.metadata(identifier)
+                else:
+                    removed.append(identifier)
+            catalog.save()
+            self.callback(changed, removed)
+        except Exception as e:
+            print('Error updating the catalog:', e)
@@ -0,0 +1,61 @@
+'''
+Background threads that work through a list of requests, such as the
+title screens to decode or scale next. Only the latest list matters:
+when the user moves on, the requests that weren't handled yet are
+replaced by new ones.
+
+'''
+from threading import Thread, Condition
+
+
+class Worker:
+    '''
+    Calls handle(item) in `threads` background threads for the items
+    given to submit(), in order. Exceptions raised by handle() are
+    ignored, because a request that fails is simply handled again
+    when it is needed.
+
+    '''
+
+    def __init__(self, handle, threads=1):
+        self.handle = handle
+        self.pending = []
+        self.busy = 0
+        self.stopped = False
+        self.condition = Condition()
+        for _ in range(threads):
+            Thread(target=self.run, daemon=True).start()
+
+    def submit(self, items):
+        '''Handle the given items, replacing any previous items that weren't handled yet'''
+        with self.condition:
+            if not self.stopped:
+                self.pending = list(items)
+                self.condition.notify_all()
+
+    def stop(self):
+        '''Drop the pending items, ignore new ones and wait for the items being handled'''
+        with self.condition:
+            self.stopped = True
+            self.pending = []
+            self.condition.notify_all()
+            while self.busy:
+                self.condition.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                item = self.pending.pop(0)
+                self.busy += 1
+            try:
+                self.handle(item)
+            except:
+                pass
+            finally:
+                with self.condition:
+                    self.busy -= 1
+                    self.condition.notify_all()